@@ -1,14 +1,32 @@
 import pandas as pd
 import numpy as np
-import sys
 import os
+import math
+import asyncio
+import hashlib
+import inspect
+import json
 import joblib
+from concurrent.futures import ThreadPoolExecutor
+from scipy import sparse
+from scipy.sparse.linalg import svds
 from surprise import SVD, Dataset, Reader
 from surprise.model_selection import cross_validate
 
-# Add the parent directory to the path to import supabase_client
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
-from supabase_client import supabase
+from app.supabase_client import supabase
+
+# 20 epochs is enough for RMSE to plateau on this data size
+SVD_EPOCHS = 20
+SVD_FACTORS = 20
+
+# "sgd" = Surprise SGD, "sparse" = truncated SVD on the sparse rating matrix
+SVD_BACKEND = os.environ.get("SVD_BACKEND", "sgd")
+
+# Opt-in on-disk cache of trained models so unchanged ratings don't trigger a retrain
+# (useful for local runs). Unset = no caching, so CI doesn't write a pickled model copy
+# under apps/ that would be baked into the Docker image.
+MODEL_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR")
+memory = joblib.Memory(MODEL_CACHE_DIR, verbose=0)
 
 # =============================
 # 1) Fetch data dari Supabase
@@ -17,7 +35,7 @@ def get_users_from_db():
     try:
         if supabase is None:
             raise Exception("Supabase client is not initialized")
-        r = supabase.table("custom_users").select("user_id, name").execute()
+        r = supabase.table("custom_users").select("user_id").execute()
         return pd.DataFrame(r.data)
     except Exception as e:
         print(f"Error fetching users: {e}")
@@ -27,49 +45,170 @@ def get_items_from_db():
     try:
         if supabase is None:
             raise Exception("Supabase client is not initialized")
-        r = supabase.table("destinasi").select("destinasi_id, nama_destinasi, kategori_id, deskripsi").execute()
+        r = supabase.table("destinasi").select("destinasi_id, kategori_id").execute()
         return pd.DataFrame(r.data)
     except Exception as e:
         print(f"Error fetching items: {e}")
         return pd.DataFrame()
 
+def get_ratings_from_rpc():
+    """
+    Fetch every rating in one round-trip via the get_all_ratings() RPC (see db.sql).
+    The function returns a single JSON object of column arrays, so PostgREST's
+    max-rows cap doesn't apply and no OFFSET pages are re-scanned.
+    """
+    r = supabase.rpc("get_all_ratings").execute()
+    cols = r.data or {}
+    return pd.DataFrame(
+        {
+            "user_id": np.asarray(cols.get("user_id") or [], dtype=object),
+            "destinasi_id": np.asarray(cols.get("destinasi_id") or [], dtype=object),
+            "rating": np.asarray(cols.get("rating") or [], dtype=np.float32),
+        },
+        copy=False,
+    )
+
 def get_ratings_from_db():
     try:
         if supabase is None:
             raise Exception("Supabase client is not initialized")
         
+        try:
+            all_ratings = get_ratings_from_rpc()
+            print(f"Successfully fetched all {len(all_ratings)} ratings via get_all_ratings RPC")
+            return all_ratings
+        except Exception as e:
+            print(f"⚠️ get_all_ratings RPC unavailable ({e}), falling back to paged fetch")
+        
         # First, get the total count of ratings
-        count_result = supabase.table("ratings").select("user_id", count="exact").execute()
+        count_result = supabase.table("ratings").select("user_id", count="exact", head=True).execute()
         total_ratings = count_result.count if hasattr(count_result, 'count') else 0
         print(f"Total ratings in database: {total_ratings}")
         
-        # Fetch all ratings without limit
-        all_ratings = []
+        # Fetch all pages concurrently; each page is an independent round-trip
         page_size = 1000  # Supabase default limit
-        offset = 0
-        
-        while True:
-            r = supabase.table("ratings").select("user_id, destinasi_id, rating").range(offset, offset + page_size - 1).execute()
-            
-            if not r.data:
-                break
-                
-            all_ratings.extend(r.data)
-            print(f"Fetched {len(r.data)} ratings (total so far: {len(all_ratings)})")
-            
-            # If we got less than page_size, we've reached the end
-            if len(r.data) < page_size:
-                break
-                
-            offset += page_size
+        total_ratings = total_ratings or 0
+        pages = math.ceil(total_ratings / page_size)
+
+        if pages == 0:
+            return pd.DataFrame()
+
+        # Preallocate kolom (SoA) supaya tiap page langsung ditulis ke slice-nya
+        uids = np.empty(total_ratings, dtype=object)
+        dids = np.empty(total_ratings, dtype=object)
+        ratings = np.empty(total_ratings, dtype=np.float32)
+
+        def fetch_page(i):
+            off = i * page_size
+            # Pages are separate requests fetched concurrently; without a stable ORDER BY on
+            # the unique rating_id, Postgres may return overlapping or missing rows per page
+            r = supabase.table("ratings").select("user_id, destinasi_id, rating").order("rating_id").range(off, off + page_size - 1).execute()
+            # Rows inserted after the count query are ignored
+            rows = r.data[:total_ratings - off]
+            n = len(rows)
+            uids[off:off + n] = [row["user_id"] for row in rows]
+            dids[off:off + n] = [row["destinasi_id"] for row in rows]
+            ratings[off:off + n] = [row["rating"] for row in rows]
+            print(f"Fetched page {i + 1}/{pages} ({n} ratings)")
+            return n
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            fetched = list(executor.map(fetch_page, range(pages)))
+
+        # Drop unfilled slots if rows were deleted between the count and the fetch
+        mask = np.ones(total_ratings, dtype=bool)
+        for i, n in enumerate(fetched):
+            mask[i * page_size + n:(i + 1) * page_size] = False
+
+        all_ratings = pd.DataFrame(
+            {"user_id": uids[mask], "destinasi_id": dids[mask], "rating": ratings[mask]},
+            copy=False,
+        )
         
         print(f"Successfully fetched all {len(all_ratings)} ratings from database")
-        return pd.DataFrame(all_ratings)
+        return all_ratings
         
     except Exception as e:
         print(f"Error fetching ratings: {e}")
         return pd.DataFrame()
 
+async def fetch_all_from_db():
+    # Ketiga query independen: jalankan bersamaan supaya latency-nya overlap
+    return await asyncio.gather(
+        asyncio.to_thread(get_users_from_db),
+        asyncio.to_thread(get_items_from_db),
+        asyncio.to_thread(get_ratings_from_db),
+    )
+
+def fit_sparse_svd(trainset, n_factors=20):
+    """
+    Truncated SVD of the mean-centred sparse rating matrix, loaded into a
+    Surprise SVD so the serving code (algo.predict, algo.qi, ...) is unchanged.
+    The dense user x item matrix is never materialized.
+    """
+    k = min(n_factors, trainset.n_users - 1, trainset.n_items - 1)
+    if k < 1:
+        return None
+
+    ratings = np.array(list(trainset.all_ratings()), dtype=np.float64)
+    R = sparse.csr_matrix(
+        (ratings[:, 2] - trainset.global_mean, (ratings[:, 0].astype(np.int64), ratings[:, 1].astype(np.int64))),
+        shape=(trainset.n_users, trainset.n_items),
+    )
+    U, S, Vt = svds(R, k=k, random_state=42)
+
+    # n_epochs=0 only initializes the model (zero biases) against this trainset
+    algo = SVD(n_factors=k, n_epochs=0, random_state=42)
+    algo.fit(trainset)
+    sqrt_s = np.sqrt(S)
+    algo.pu = U * sqrt_s
+    algo.qi = Vt.T * sqrt_s
+    return algo
+
+def _fit_code_hash():
+    # joblib only tracks train_svd's own source; fold in the helper it calls
+    return hashlib.blake2b(inspect.getsource(fit_sparse_svd).encode(), digest_size=8).hexdigest()
+
+@memory.cache(ignore=["data"])
+def train_svd(ratings_hash, data, backend="sgd", n_factors=SVD_FACTORS, n_epochs=SVD_EPOCHS, fit_code_hash=None):
+    """
+    Fit SVD on the full trainset. Every input that changes the model is an argument
+    (ratings_hash, backend, n_factors, n_epochs, fit_code_hash) so it is part of the cache key.
+    """
+    print(f"Training SVD ({backend}) for ratings hash {ratings_hash[:12]}...")
+    trainset = data.build_full_trainset()
+    if backend == "sparse":
+        algo = fit_sparse_svd(trainset, n_factors=n_factors)
+        if algo is not None:
+            return algo, trainset
+        print("⚠️ Rating matrix too small for sparse SVD, falling back to SGD")
+    algo = SVD(n_factors=n_factors, n_epochs=n_epochs, random_state=42)
+    algo.fit(trainset)
+    return algo, trainset
+
+def int_ids_to_str(col):
+    # int -> str lewat numpy (C loop) daripada astype(str) per elemen di object dtype
+    return pd.Series(col.to_numpy(dtype=np.int64).astype(str), index=col.index, dtype=object)
+
+def export_serving_artifacts(payload, trainset, out_dir="apps/artifacts/serving"):
+    """
+    Simpan hanya yang dipakai saat serving: faktor laten sebagai .npy (bisa di-mmap)
+    plus id map dan kategori sebagai JSON, tanpa pickle objek Surprise.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    for name, arr in payload["factors"].items():
+        np.save(os.path.join(out_dir, f"{name}.npy"), np.ascontiguousarray(arr, dtype=np.float32))
+    meta = {
+        "global_mean": float(payload["global_mean"]),
+        "rating_scale": list(trainset.rating_scale),
+        # raw id berurutan sesuai inner id
+        "item_ids": [trainset.to_raw_iid(i) for i in range(trainset.n_items)],
+        "user_ids": [trainset.to_raw_uid(u) for u in range(trainset.n_users)],
+        "item_categories": payload["item_categories"],
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
 def main():
     # Check if supabase is properly configured
     if supabase is None:
@@ -80,9 +219,7 @@ def main():
     
     print("✅ Supabase client initialized successfully")
     
-    df_users  = get_users_from_db()
-    df_items  = get_items_from_db()
-    df_ratings = get_ratings_from_db()
+    df_users, df_items, df_ratings = asyncio.run(fetch_all_from_db())
 
     # Check if data was fetched successfully
     if df_users.empty:
@@ -112,19 +249,25 @@ def main():
 
     # Surprise lebih aman kalau raw id berupa string
     df_ratings["user_id"] = df_ratings["user_id"].astype(str)
-    df_ratings["destinasi_id"] = df_ratings["destinasi_id"].astype(str)
-    df_items["destinasi_id"] = df_items["destinasi_id"].astype(str)
-    df_items["kategori_id"] = df_items["kategori_id"].astype(int)
+    df_ratings["destinasi_id"] = int_ids_to_str(df_ratings["destinasi_id"])
+    df_ratings["rating"] = df_ratings["rating"].astype(np.float32, copy=False)
+    df_items["destinasi_id"] = int_ids_to_str(df_items["destinasi_id"])
+    df_items["kategori_id"] = pd.to_numeric(df_items["kategori_id"], downcast="integer")
 
     # =============================
     # 2) Train SVD
     # =============================
     reader = Reader(rating_scale=(1,5))
     data = Dataset.load_from_df(df_ratings[['user_id','destinasi_id','rating']], reader)
-    trainset = data.build_full_trainset()
 
-    algo = SVD(n_factors=20, n_epochs=50, random_state=42)
-    algo.fit(trainset)
+    # Ratings yang sama -> hash sama -> model diambil dari cache, tidak retrain
+    ratings_hash = hashlib.blake2b(
+        pd.util.hash_pandas_object(df_ratings[['user_id','destinasi_id','rating']], index=False).values.tobytes()
+    ).hexdigest()
+    algo, trainset = train_svd(
+        ratings_hash, data, backend=SVD_BACKEND,
+        n_factors=SVD_FACTORS, n_epochs=SVD_EPOCHS, fit_code_hash=_fit_code_hash()
+    )
 
     # =============================
     # Print Metrics
@@ -145,14 +288,21 @@ def main():
     print(df_items['kategori_id'].value_counts().sort_index())
     print() #newline
 
-    print("=============================")
-    print("Model Performance Metrics:")
-    print("=============================")
-    # Cross-validation metrics
-    cv_results = cross_validate(algo, data, measures=['RMSE', 'MAE'], cv=3, verbose=True)
-    print(f"RMSE: {cv_results['test_rmse'].mean():.4f} (+/- {cv_results['test_rmse'].std() * 2:.4f})")
-    print(f"MAE: {cv_results['test_mae'].mean():.4f} (+/- {cv_results['test_mae'].std() * 2:.4f})")
-    print() #newline
+    # Cross-validation metrics (3 extra full trains, only printed) - opt-in via RUN_CV=1
+    if os.environ.get("RUN_CV") == "1" and SVD_BACKEND == "sparse":
+        # Surprise would CV the SVD(n_epochs=0) shell, i.e. untrained random factors
+        print("⚠️ RUN_CV=1 is not supported with SVD_BACKEND=sparse, skipping cross-validation")
+    elif os.environ.get("RUN_CV") == "1":
+        print("=============================")
+        print("Model Performance Metrics:")
+        print("=============================")
+        # Fresh estimator: with a sequential joblib backend cross_validate refits the
+        # object it is given in place, which would overwrite the model saved below
+        cv_algo = SVD(n_factors=SVD_FACTORS, n_epochs=SVD_EPOCHS, random_state=42)
+        cv_results = cross_validate(cv_algo, data, measures=['RMSE', 'MAE'], cv=3, n_jobs=-1, verbose=True)
+        print(f"RMSE: {cv_results['test_rmse'].mean():.4f} (+/- {cv_results['test_rmse'].std() * 2:.4f})")
+        print(f"MAE: {cv_results['test_mae'].mean():.4f} (+/- {cv_results['test_mae'].std() * 2:.4f})")
+        print() #newline
 
     # Create artifacts directory if it doesn't exist
     os.makedirs("apps/artifacts", exist_ok=True)
@@ -160,12 +310,23 @@ def main():
     payload = {
         "algo": algo,
         "trainset": trainset,
-        "items_df": df_items[['destinasi_id', 'kategori_id']].copy(),
+        # destinasi_id -> kategori_id; lebih kecil dari DataFrame dan lookup O(1)
+        "item_categories": dict(zip(df_items["destinasi_id"].tolist(), df_items["kategori_id"].astype(np.int16).tolist())),
         "global_mean": trainset.global_mean,
+        # Faktor laten sebagai array float32 untuk scoring tervektorisasi saat serving
+        "factors": {
+            "pu": np.asarray(algo.pu, dtype=np.float32),
+            "qi": np.asarray(algo.qi, dtype=np.float32),
+            "bu": np.asarray(algo.bu, dtype=np.float32),
+            "bi": np.asarray(algo.bi, dtype=np.float32),
+        },
     }
-    joblib.dump(payload, "apps/artifacts/model.pkl")
+    joblib.dump(payload, "apps/artifacts/model.pkl", compress=("lz4", 3))
 
     print("✅ Model saved to apps/artifacts/model.pkl")
 
+    export_serving_artifacts(payload, trainset)
+    print("✅ Serving artifacts saved to apps/artifacts/serving")
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,5 @@
+import os
+
+# Custom DB/system metrics (monitor-source) can be switched off per deployment; when
+# off, monitor-source is never imported so none of its series are registered
+ENABLE_CUSTOM_METRICS = os.getenv("ENABLE_CUSTOM_METRICS", "1") == "1"
@@ -3,14 +3,15 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from cachetools import TTLCache
 import uuid
+import asyncio
+import time
 from datetime import datetime, timedelta
-import sys
 import os
 from dotenv import load_dotenv
 
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
-from supabase_client import supabase
+from app.supabase_client import supabase, run_query
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
@@ -19,10 +20,22 @@ SECRET_KEY = os.getenv("JWT_SECRET")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Argon2id for new hashes; bcrypt is kept so existing hashes still verify
+# and get rehashed on the next successful login
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__type="ID",
+    argon2__time_cost=2,
+    argon2__memory_cost=46 * 1024,
+    argon2__parallelism=1,
+)
 
 security = HTTPBearer()
 
+# token -> (user dict, token exp); skips JWT decode + DB lookup for repeat requests
+_user_cache = TTLCache(maxsize=10_000, ttl=60)
+
 class UserSignup(BaseModel):
     name: str
     email: EmailStr
@@ -43,11 +56,12 @@ class TokenData(BaseModel):
     email: str = None
     user_id: str = None
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# Hashing is CPU-bound, so run it in a worker thread to keep the event loop free
+async def verify_and_update_password(plain_password, hashed_password):
+    return await asyncio.to_thread(pwd_context.verify_and_update, plain_password, hashed_password)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await asyncio.to_thread(pwd_context.hash, password)
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
@@ -65,8 +79,15 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    token = credentials.credentials
+    cached = _user_cache.get(token)
+    if cached is not None:
+        user, exp = cached
+        if exp is None or exp > time.time():
+            return user
+        _user_cache.pop(token, None)
+    
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         user_id: str = payload.get("user_id")
@@ -76,17 +97,19 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except JWTError:
         raise credentials_exception
     
-    result = supabase.table("custom_users").select("*").eq("user_id", token_data.user_id).execute()
+    result = await run_query(supabase.table("custom_users").select("user_id, name, email, created_at").eq("user_id", token_data.user_id))
     if not result.data:
         raise credentials_exception
     
     user = result.data[0]
-    return {
+    current_user = {
         "user_id": user["user_id"],
         "name": user["name"],
         "email": user["email"],
         "created_at": user.get("created_at")
     }
+    _user_cache[token] = (current_user, payload.get("exp"))
+    return current_user
 
 @router.post("/signup", response_model=AuthResponse)
 async def signup(user_data: UserSignup):
@@ -99,15 +122,16 @@ async def signup(user_data: UserSignup):
                 detail="Database connection not configured. Please set up Supabase credentials."
             )
         
-        existing_user = supabase.table("custom_users").select("*").eq("email", user_data.email).execute()
+        # HEAD count: existence probe without transferring any rows
+        existing_user = await run_query(supabase.table("custom_users").select("user_id", count="exact", head=True).eq("email", user_data.email))
         
-        if existing_user.data:
+        if existing_user.count:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="User with this email already exists"
             )
         
-        hashed_password = get_password_hash(user_data.password)
+        hashed_password = await get_password_hash(user_data.password)
         
         user_id = str(uuid.uuid4())
         new_user = {
@@ -118,7 +142,7 @@ async def signup(user_data: UserSignup):
             "created_at": datetime.utcnow().isoformat()
         }
         
-        result = supabase.table("custom_users").insert(new_user).execute()
+        result = await run_query(supabase.table("custom_users").insert(new_user))
         print(f"Insert result: {result}")  # Debug log
         
         if result.data:
@@ -167,13 +191,18 @@ async def login(user_credentials: UserLogin):
                 detail="Database connection not configured. Please set up Supabase credentials."
             )
         
-        result = supabase.table("custom_users").select("*").eq("email", user_credentials.email).execute()
+        result = await run_query(supabase.table("custom_users").select("user_id, name, email, created_at, password").eq("email", user_credentials.email))
         print(f"Login query result: {result}")  # Debug log
         
         if result.data:
             user = result.data[0]
             
-            if verify_password(user_credentials.password, user["password"]):
+            valid, new_hash = await verify_and_update_password(user_credentials.password, user["password"])
+            if valid:
+                if new_hash:
+                    # Upgrade legacy bcrypt hash to argon2
+                    await run_query(supabase.table("custom_users").update({"password": new_hash}).eq("user_id", user["user_id"]))
+                
                 user_data_response = {
                     "user_id": user["user_id"],
                     "name": user["name"],
@@ -1,12 +1,8 @@
 from fastapi import APIRouter, HTTPException, status
 from pydantic import BaseModel
 from typing import List
-import sys
-import os
 
-# Add the parent directory to the path to import supabase_client
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
-from supabase_client import supabase
+from app.supabase_client import supabase, run_query
 
 router = APIRouter(prefix="/categories", tags=["Categories"])
 
@@ -34,7 +30,7 @@ async def get_categories():
             )
         
         # Fetch all categories from the category table
-        result = supabase.table("category").select("kategori_id, nama, label").execute()
+        result = await run_query(supabase.table("category").select("kategori_id, nama, label"))
         
         if result.data:
             return result.data
@@ -61,7 +57,7 @@ async def test_categories():
             return {"message": "Database connection not configured"}
         
         # Test connection by counting categories
-        result = supabase.table("category").select("kategori_id", count="exact").execute()
+        result = await run_query(supabase.table("category").select("kategori_id", count="exact", head=True))
         return {
             "message": "Category endpoint is working!",
             "total_categories": result.count if result.count is not None else 0
@@ -1,18 +1,23 @@
-from fastapi import APIRouter, HTTPException, status, Depends
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, status, Depends, Request, Response
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional
-import sys
-import os
+import asyncio
+import hashlib
+import orjson
 
-# Add the parent directory to the path to import supabase_client and auth
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
-from supabase_client import supabase
+from app.supabase_client import supabase, run_query, select_in
 from app.routers.auth import get_current_user
 
 router = APIRouter(prefix="/destinations", tags=["Destinations"])
 
+# Destination list is shared by all users, so clients may reuse it for a few minutes
+DESTINATIONS_CACHE_CONTROL = "private, max-age=300"
+
 # Pydantic models
 class Destination(BaseModel):
+    # Supabase returns destinasi_id as int; let pydantic coerce it to str
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
     destinasi_id: str
     nama_destinasi: str
     kategori_id: int
@@ -33,9 +38,14 @@ class DestinationsResponse(BaseModel):
     destinations: List[Destination]
 
 @router.get("/", response_model=DestinationsResponse)
-async def get_all_destinations(current_user: dict = Depends(get_current_user)):
+async def get_all_destinations(
+    request: Request,
+    response: Response,
+    current_user: dict = Depends(get_current_user)
+):
     """
-    Get all destinations with basic information
+    Get all destinations with basic information.
+    Returns 304 Not Modified when the client's If-None-Match matches the current ETag.
     """
     try:
         print(f"Get all destinations request from user: {current_user.get('user_id', 'unknown')}")
@@ -50,42 +60,38 @@ async def get_all_destinations(current_user: dict = Depends(get_current_user)):
         # Fetch all destinations and categories separately, then combine
         print("Executing Supabase queries...")
         
-        # Get all destinations
-        dest_result = supabase.table("destinasi").select(
-            "destinasi_id, nama_destinasi, kategori_id, deskripsi, image_url"
-        ).order("destinasi_id").execute()
-        
-        # Get all categories for lookup
-        cat_result = supabase.table("category").select(
-            "kategori_id, nama"
-        ).execute()
+        # Get all destinations and all categories (for lookup) concurrently
+        dest_result, cat_result = await asyncio.gather(
+            run_query(supabase.table("destinasi").select(
+                "destinasi_id, nama_destinasi, kategori_id, deskripsi, image_url"
+            ).order("destinasi_id")),
+            run_query(supabase.table("category").select(
+                "kategori_id, nama"
+            ))
+        )
         
         print(f"Destinations result: {len(dest_result.data) if dest_result.data else 0} destinations found")
         print(f"Categories result: {len(cat_result.data) if cat_result.data else 0} categories found")
         
         if dest_result.data:
             # Create category lookup dictionary
-            category_lookup = {}
-            if cat_result.data:
-                for cat in cat_result.data:
-                    category_lookup[cat["kategori_id"]] = cat["nama"]
-                print(f"Category lookup: {category_lookup}")
+            category_lookup = {cat["kategori_id"]: cat["nama"] for cat in cat_result.data or []}
             
-            # Convert data types to match Pydantic model
-            destinations = []
-            for dest in dest_result.data:
-                destinations.append({
-                    "destinasi_id": str(dest["destinasi_id"]),  # Convert to string
-                    "nama_destinasi": dest["nama_destinasi"],
-                    "kategori_id": int(dest["kategori_id"]),
-                    "deskripsi": dest["deskripsi"],
-                    "image_url": dest.get("image_url"),
-                    "category_name": category_lookup.get(dest["kategori_id"], "Unknown Category")
-                })
-            print(f"Returning destinations with categories: {[d['category_name'] for d in destinations[:3]]}")
-            return {"destinations": destinations}
+            destinations = [
+                {**dest, "category_name": category_lookup.get(dest["kategori_id"], "Unknown Category")}
+                for dest in dest_result.data
+            ]
         else:
-            return {"destinations": []}
+            destinations = []
+        
+        body = {"destinations": destinations}
+        etag = f'"{hashlib.blake2b(orjson.dumps(body), digest_size=8).hexdigest()}"'
+        cache_headers = {"ETag": etag, "Cache-Control": DESTINATIONS_CACHE_CONTROL}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
+        
+        response.headers.update(cache_headers)
+        return body
             
     except HTTPException:
         raise
@@ -112,9 +118,9 @@ async def get_destination_by_id(
             )
         
         # Fetch destination with category name, image_url, and full_deskripsi
-        result = supabase.table("destinasi").select(
+        result = await run_query(supabase.table("destinasi").select(
             "destinasi_id, nama_destinasi, kategori_id, deskripsi, full_deskripsi, image_url, category(nama)"
-        ).eq("destinasi_id", destination_id).execute()
+        ).eq("destinasi_id", destination_id))
         
         if result.data and len(result.data) > 0:
             destination = result.data[0]
@@ -144,7 +150,7 @@ async def get_destination_by_id(
 
 @router.post("/batch", response_model=List[DestinationDetails])
 async def get_destinations_by_ids(
-    destination_ids: List[str],
+    destination_ids: List[int],
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -162,38 +168,16 @@ async def get_destinations_by_ids(
         
         print(f"Fetching destinations for IDs: {destination_ids}")  # Debug log
         
-        # Try to convert string IDs to integers if needed
-        processed_ids = []
-        for dest_id in destination_ids:
-            try:
-                # Try as integer first
-                processed_ids.append(int(dest_id))
-            except ValueError:
-                # Keep as string if conversion fails
-                processed_ids.append(dest_id)
-        
-        print(f"Processed IDs: {processed_ids}")  # Debug log
-        
         # Fetch destinations including image_url
-        result = supabase.table("destinasi").select(
-            "destinasi_id, nama_destinasi, kategori_id, deskripsi, image_url"
-        ).in_("destinasi_id", processed_ids).execute()
-        
-        print(f"Database query result: {result}")  # Debug log
+        rows = await select_in(
+            "destinasi", "destinasi_id", destination_ids,
+            "destinasi_id,nama_destinasi,kategori_id,deskripsi,image_url"
+        )
         
-        if result.data:
-            destinations = []
-            for destination in result.data:
-                destinations.append({
-                    "destinasi_id": str(destination["destinasi_id"]),  # Ensure string format
-                    "nama_destinasi": destination["nama_destinasi"],
-                    "kategori_id": destination["kategori_id"],
-                    "deskripsi": destination["deskripsi"],
-                    "image_url": destination.get("image_url"),
-                    "category_name": None  # We'll add category lookup later if needed
-                })
-            print(f"Returning {len(destinations)} destinations")  # Debug log
-            return destinations
+        if rows:
+            # Rows already match DestinationDetails; category_name defaults to None
+            print(f"Returning {len(rows)} destinations")  # Debug log
+            return rows
         else:
             print("No destinations found in database")  # Debug log
             return []
@@ -1,12 +1,8 @@
 from fastapi import APIRouter, HTTPException, status, Depends
 from pydantic import BaseModel
 from typing import List
-import sys
-import os
 
-# Add the parent directory to the path to import supabase_client and auth
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
-from supabase_client import supabase
+from app.supabase_client import supabase, run_query
 from app.routers.auth import get_current_user
 
 router = APIRouter(prefix="/users", tags=["Users"])
@@ -43,10 +39,10 @@ async def check_user_preferences_status(current_user: dict = Depends(get_current
         
         user_id = current_user['user_id']
         
-        # Check if user has any preferences in the test table
-        result = supabase.table("preference").select("user_id").eq("user_id", user_id).execute()
+        # HEAD count: only the number of preference rows is returned, not the rows
+        result = await run_query(supabase.table("preference").select("user_id", count="exact", head=True).eq("user_id", user_id))
         
-        preference_count = len(result.data) if result.data else 0
+        preference_count = result.count or 0
         has_preferences = preference_count > 0
         
         return PreferenceStatusResponse(
@@ -88,39 +84,41 @@ async def save_user_preferences(
         
         user_id = current_user['user_id']
         
-        # First, delete existing preferences for this user to replace them
-        delete_result = supabase.table("preference").delete().eq("user_id", user_id).execute()
-        print(f"Deleted existing preferences: {delete_result}")  # Debug log
-        
-        # Prepare data for insertion
-        preferences_data = []
-        for pref in request.preferences:
-            preferences_data.append({
+        # Prepare data for upsert (one row per kategori_id)
+        preferences_data = list({
+            pref.kategori_id: {
                 "user_id": user_id,
                 "kategori_id": pref.kategori_id,
                 "weight": pref.weight
-            })
+            }
+            for pref in request.preferences
+        }.values())
         
-        # Insert new preferences
-        if preferences_data:
-            insert_result = supabase.table("preference").insert(preferences_data).execute()
-            print(f"Insert result: {insert_result}")  # Debug log
-            
-            if insert_result.data:
-                return PreferencesResponse(
-                    message="Preferences saved successfully!",
-                    saved_count=len(preferences_data)
-                )
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Failed to save preferences"
-                )
-        else:
+        if not preferences_data:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="No preferences provided"
             )
+        
+        # Upsert on the (user_id, kategori_id) primary key, then purge categories no longer selected
+        upsert_result = await run_query(supabase.table("preference").upsert(
+            preferences_data, on_conflict="user_id,kategori_id"
+        ))
+        print(f"Upsert result: {upsert_result}")  # Debug log
+        
+        if not upsert_result.data:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Failed to save preferences"
+            )
+        
+        kept_ids = [pref["kategori_id"] for pref in preferences_data]
+        await run_query(supabase.table("preference").delete().eq("user_id", user_id).not_.in_("kategori_id", kept_ids))
+        
+        return PreferencesResponse(
+            message="Preferences saved successfully!",
+            saved_count=len(preferences_data)
+        )
             
     except HTTPException:
         raise
@@ -146,9 +144,9 @@ async def get_user_preferences(current_user: dict = Depends(get_current_user)):
         user_id = current_user['user_id']
         
         # Get user preferences with category details
-        result = supabase.table("preference").select(
+        result = await run_query(supabase.table("preference").select(
             "kategori_id, weight, category(label)"
-        ).eq("user_id", user_id).execute()
+        ).eq("user_id", user_id))
         
         return {
             "message": "Preferences retrieved successfully",
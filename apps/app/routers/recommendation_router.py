@@ -1,14 +1,27 @@
+import asyncio
+import logging
+
 from fastapi import APIRouter, HTTPException, status, Depends, Query
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import List, Optional
-import sys
-import os
 
-# Add the parent directory to the path to import supabase_client and recommendation
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
-from supabase_client import supabase
-from recommendation import recommend
+from app.supabase_client import supabase, select_eq
+from recommendation import recommend, prefetch_catalog
 from app.routers.auth import get_current_user
+from app.config import ENABLE_CUSTOM_METRICS
+
+def record_recommendations(count: int):
+    pass
+
+if ENABLE_CUSTOM_METRICS:
+    try:
+        from metrics import record_recommendations
+    except ImportError:
+        # monitor-source not on the path (e.g. running without monitoring)
+        pass
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/recommendations", tags=["Recommendations"])
 
@@ -24,6 +37,14 @@ class RecommendationsResponse(BaseModel):
     recommendations: List[RecommendationItem]
     based_on_categories: Optional[List[int]] = None
 
+def _recommendations_response(recommendations, **fields):
+    """Build the RecommendationsResponse shape as plain dicts in an ORJSONResponse, skipping pydantic"""
+    record_recommendations(len(recommendations))
+    return ORJSONResponse({
+        **fields,
+        "recommendations": [{"destinasi_id": d, "score": s} for d, s in recommendations],
+    })
+
 @router.get("/", response_model=RecommendationsResponse)
 async def get_recommendations(
     n: int = Query(default=None, ge=1, description="Number of recommendations to return (default: all available)"),
@@ -43,29 +64,31 @@ async def get_recommendations(
             )
         
         user_id = current_user['user_id']
-        print(f"Getting recommendations for user: {user_id}")  # Debug log
+        logger.debug("Getting recommendations for user: %s", user_id)
         
-        # Fetch user preferences to extract kategori_ids
-        preferences_result = supabase.table("preference").select(
-            "kategori_id, weight"
-        ).eq("user_id", user_id).execute()
+        # Fetch user preferences while the candidate catalog is warmed in parallel;
+        # recommend() then filters the cached catalog by category in memory
+        preferences, _ = await asyncio.gather(
+            select_eq("preference", "user_id", user_id, "kategori_id,weight"),
+            prefetch_catalog()
+        )
         
         # Extract category IDs from preferences
         selected_cat_ids = None
-        if preferences_result.data:
-            selected_cat_ids = [pref["kategori_id"] for pref in preferences_result.data]
-            print(f"User preferences (categories): {selected_cat_ids}")  # Debug log
+        if preferences:
+            selected_cat_ids = [pref["kategori_id"] for pref in preferences]
+            logger.debug("User preferences (categories): %s", selected_cat_ids)
         
         # Get recommendations using the recommendation engine
         # If n is None, get all available destinations (set to a large number)
         recommendation_count = n if n is not None else 1000  # Large number to get all destinations
-        print(f"[DEBUG] Calling recommend with n={recommendation_count}")  # Debug log
-        recommendations = recommend(
+        logger.debug("Calling recommend with n=%s", recommendation_count)
+        recommendations = await recommend(
             user_id=user_id,
             selected_cat_ids=selected_cat_ids,
             n=recommendation_count
         )
-        print(f"[DEBUG] Got {len(recommendations)} recommendations from recommend()")  # Debug log
+        logger.debug("Got %d recommendations from recommend()", len(recommendations))
         
         # Determine recommendation type
         if not recommendations:
@@ -80,24 +103,18 @@ async def get_recommendations(
             recommendation_type = "personalized"
             message = "Personalized recommendations based on your interaction history"
         
-        # Format recommendations
-        formatted_recommendations = [
-            RecommendationItem(destinasi_id=str(item[0]), score=float(item[1]))
-            for item in recommendations
-        ]
-        
-        return RecommendationsResponse(
+        return _recommendations_response(
+            recommendations,
             message=message,
             user_id=user_id,
             recommendation_type=recommendation_type,
-            recommendations=formatted_recommendations,
             based_on_categories=selected_cat_ids
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Get recommendations error: {str(e)}")  # Debug logging
+        logger.exception("Get recommendations error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to get recommendations: {str(e)}"
@@ -115,33 +132,27 @@ async def get_recommendations_by_category(
     """
     try:
         user_id = current_user['user_id']
-        print(f"Getting recommendations for user: {user_id}, category: {category_id}")
+        logger.debug("Getting recommendations for user: %s, category: %s", user_id, category_id)
         
         # Get recommendations for specific category
         # If n is None, get all available destinations (set to a large number)
         recommendation_count = n if n is not None else 1000  # Large number to get all destinations
-        recommendations = recommend(
+        recommendations = await recommend(
             user_id=user_id,
             selected_cat_ids=[category_id],
             n=recommendation_count
         )
         
-        # Format recommendations
-        formatted_recommendations = [
-            RecommendationItem(destinasi_id=str(item[0]), score=float(item[1]))
-            for item in recommendations
-        ]
-        
-        return RecommendationsResponse(
+        return _recommendations_response(
+            recommendations,
             message=f"Recommendations for category {category_id}",
             user_id=user_id,
             recommendation_type="category_filtered",
-            recommendations=formatted_recommendations,
             based_on_categories=[category_id]
         )
         
     except Exception as e:
-        print(f"Get category recommendations error: {str(e)}")
+        logger.exception("Get category recommendations error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to get category recommendations: {str(e)}"
@@ -159,33 +170,27 @@ async def get_cold_start_recommendations(
     """
     try:
         user_id = current_user['user_id']
-        print(f"Getting cold start recommendations for categories: {category_ids}")
+        logger.debug("Getting cold start recommendations for categories: %s", category_ids)
         
         # Force cold start by setting user_id to None
         # If n is None, get all available destinations (set to a large number)
         recommendation_count = n if n is not None else 1000  # Large number to get all destinations
-        recommendations = recommend(
+        recommendations = await recommend(
             user_id=None,  # Force cold start
             selected_cat_ids=category_ids,
             n=recommendation_count
         )
         
-        # Format recommendations
-        formatted_recommendations = [
-            RecommendationItem(destinasi_id=str(item[0]), score=float(item[1]))
-            for item in recommendations
-        ]
-        
-        return RecommendationsResponse(
+        return _recommendations_response(
+            recommendations,
             message=f"Cold start recommendations for categories: {category_ids}",
             user_id=user_id,
             recommendation_type="cold_start",
-            recommendations=formatted_recommendations,
             based_on_categories=category_ids
         )
         
     except Exception as e:
-        print(f"Get cold start recommendations error: {str(e)}")
+        logger.exception("Get cold start recommendations error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to get cold start recommendations: {str(e)}"
@@ -1,16 +1,27 @@
+import logging
+
 from fastapi import APIRouter, HTTPException, Depends, status
 from pydantic import BaseModel
 from typing import Optional
-import sys
-import os
 
-# Add parent directory to path to import supabase_client
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
-from supabase_client import supabase
+from app.supabase_client import supabase, rest_client, select_counted
 from .auth import get_current_user
+from recommendation import invalidate_user_recommendations
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/reviews", tags=["reviews"])
 
+# Postgres SQLSTATE returned by PostgREST for a foreign key violation
+FOREIGN_KEY_VIOLATION = "23503"
+# Foreign keys on ratings (see db.sql); the violated one is named in the error message
+DESTINATION_FKEY = "ratings_destinasi_id_fkey"
+USER_FKEY = "ratings_user_id_fkey"
+
+# Kolom yang benar-benar dipakai client untuk daftar review user
+REVIEW_COLUMNS = "rating_id,destinasi_id,rating,review,created_at,destinasi:destinasi_id(nama_destinasi,kategori_id)"
+USER_REVIEWS_LIMIT = 100
+
 class SubmitReviewRequest(BaseModel):
     destination_id: int
     rating: int  # 1-5 stars
@@ -46,62 +57,60 @@ async def submit_review(
         
         user_id = current_user['user_id']
         
-        # Check if destination exists
-        dest_check = supabase.table("destinasi").select("destinasi_id").eq("destinasi_id", request.destination_id).execute()
-        if not dest_check.data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Destination with ID {request.destination_id} not found"
-            )
-        
-        # Check if user already reviewed this destination
-        existing_review = supabase.table("ratings").select("*").eq("user_id", user_id).eq("destinasi_id", request.destination_id).execute()
+        # Insert or update in one round-trip via the (user_id, destinasi_id) unique key;
+        # a missing destination surfaces as a foreign key violation
+        review_data = {
+            "user_id": user_id,
+            "destinasi_id": request.destination_id,
+            "rating": request.rating,
+            "review": request.review
+        }
         
-        if existing_review.data:
-            # Update existing review
-            update_data = {
-                "rating": request.rating,
-                "review": request.review
-            }
-            
-            result = supabase.table("ratings").update(update_data).eq("user_id", user_id).eq("destinasi_id", request.destination_id).execute()
-            
-            if result.data:
-                return ReviewResponse(
-                    message=f"Review updated successfully for destination {request.destination_id}!",
-                    review_id=result.data[0].get('id') if result.data[0] else None
-                )
-            else:
+        resp = await rest_client.post(
+            "/ratings",
+            params={"on_conflict": "user_id,destinasi_id"},
+            json=review_data,
+            headers={"Prefer": "resolution=merge-duplicates,return=representation"}
+        )
+        if resp.status_code == status.HTTP_409_CONFLICT:
+            error = resp.json()
+            if error.get("code") == FOREIGN_KEY_VIOLATION:
+                error_text = f"{error.get('message') or ''} {error.get('details') or ''}"
+                if DESTINATION_FKEY in error_text:
+                    raise HTTPException(
+                        status_code=status.HTTP_404_NOT_FOUND,
+                        detail=f"Destination with ID {request.destination_id} not found"
+                    )
+                if USER_FKEY in error_text:
+                    # Token is still valid but the user was deleted after it was issued
+                    raise HTTPException(
+                        status_code=status.HTTP_401_UNAUTHORIZED,
+                        detail="User no longer exists"
+                    )
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Failed to update review"
+                    detail="Review references a record that does not exist"
                 )
+        resp.raise_for_status()
+        result = resp.json()
+        
+        if result:
+            # Rating baru mengubah rekomendasi user ini
+            invalidate_user_recommendations(user_id)
+            return ReviewResponse(
+                message=f"Review saved successfully for destination {request.destination_id}!",
+                review_id=result[0].get('rating_id')
+            )
         else:
-            # Insert new review
-            insert_data = {
-                "user_id": user_id,
-                "destinasi_id": request.destination_id,
-                "rating": request.rating,
-                "review": request.review
-            }
-            
-            result = supabase.table("ratings").insert(insert_data).execute()
-            
-            if result.data:
-                return ReviewResponse(
-                    message=f"Review submitted successfully for destination {request.destination_id}!",
-                    review_id=result.data[0].get('id') if result.data[0] else None
-                )
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Failed to submit review"
-                )
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Failed to submit review"
+            )
                 
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Submit review error: {str(e)}")
+        logger.exception("Submit review error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to submit review: {str(e)}"
@@ -121,20 +130,22 @@ async def get_user_reviews(current_user: dict = Depends(get_current_user)):
         
         user_id = current_user['user_id']
         
-        # Get user's reviews with destination info
-        result = supabase.table("ratings").select(
-            "*, destinasi:destinasi_id(nama_destinasi, kategori_id)"
-        ).eq("user_id", user_id).execute()
+        # Get user's latest reviews with destination info; total counts all of them,
+        # not just the USER_REVIEWS_LIMIT returned
+        reviews, total = await select_counted(
+            "ratings", REVIEW_COLUMNS,
+            {"user_id": f"eq.{user_id}", "order": "created_at.desc", "limit": USER_REVIEWS_LIMIT}
+        )
         
         return {
-            "reviews": result.data or [],
-            "total": len(result.data) if result.data else 0
+            "reviews": reviews,
+            "total": total
         }
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Get user reviews error: {str(e)}")
+        logger.exception("Get user reviews error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to get reviews: {str(e)}"
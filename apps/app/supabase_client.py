@@ -0,0 +1,91 @@
+import os
+import asyncio
+import httpx
+from supabase import create_client, Client, ClientOptions
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Supabase configuration
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY")
+
+# Per-request timeout for Supabase calls. Enforced by httpx itself, so a hung request
+# fails inside its worker thread instead of being abandoned by an asyncio timeout.
+SUPABASE_TIMEOUT = 5.0
+
+# Shared keep-alive pool so requests reuse TCP/TLS connections to Supabase
+http_client = httpx.Client(
+    http2=True,
+    timeout=SUPABASE_TIMEOUT,
+    limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+)
+
+# Async PostgREST client for handlers that must not block the event loop
+rest_client = httpx.AsyncClient(
+    base_url=f"{SUPABASE_URL or ''}/rest/v1",
+    headers={
+        "apikey": SUPABASE_KEY or "",
+        "Authorization": f"Bearer {SUPABASE_KEY or ''}",
+    },
+    http2=True,
+    timeout=SUPABASE_TIMEOUT,
+    limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+)
+
+# Create Supabase client
+try:
+    supabase: Client = create_client(
+        SUPABASE_URL,
+        SUPABASE_KEY,
+        options=ClientOptions(httpx_client=http_client, postgrest_client_timeout=SUPABASE_TIMEOUT),
+    )
+except Exception as e:
+    print(f"❌ Failed to create Supabase client: {e}")
+    supabase = None
+
+
+async def run_query(query):
+    """Execute a supabase query in a worker thread so it doesn't block the event loop"""
+    return await asyncio.to_thread(query.execute)
+
+
+async def select(table: str, projection: str, params: dict | None = None) -> list:
+    """GET /{table} through the pooled async client and return the rows"""
+    resp = await rest_client.get(f"/{table}", params={"select": projection, **(params or {})})
+    resp.raise_for_status()
+    return resp.json()
+
+
+async def select_counted(table: str, projection: str, params: dict | None = None) -> tuple[list, int]:
+    """Like select, plus the exact number of matching rows (ignoring limit) from Content-Range"""
+    resp = await rest_client.get(
+        f"/{table}",
+        params={"select": projection, **(params or {})},
+        headers={"Prefer": "count=exact"},
+    )
+    resp.raise_for_status()
+    return resp.json(), int(resp.headers["content-range"].rsplit("/", 1)[1])
+
+
+async def select_eq(table: str, col: str, value, projection: str, **params) -> list:
+    """Rows where col = value"""
+    return await select(table, projection, {col: f"eq.{value}", **params})
+
+
+def _quote(value) -> str:
+    """Double-quote a value for a PostgREST list filter, so commas/parens in it stay literal"""
+    escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+async def select_in(table: str, col: str, vals, projection: str, **params) -> list:
+    """Rows where col is one of vals"""
+    return await select(table, projection, {col: f"in.({','.join(map(_quote, vals))})", **params})
+
+
+async def close_client():
+    """Close the pooled HTTP connections (call on application shutdown)"""
+    http_client.close()
+    await rest_client.aclose()
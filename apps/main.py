@@ -1,27 +1,41 @@
+import logging
+import sys
+import os
+
+from app.config import ENABLE_CUSTOM_METRICS
+
+# Add monitor-source to path (once; it is not a package inside apps/) before the
+# routers are imported, since they record custom metrics from it
+MONITOR_SOURCE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'monitor-source'))
+if ENABLE_CUSTOM_METRICS and MONITOR_SOURCE_PATH not in sys.path:
+    sys.path.insert(0, MONITOR_SOURCE_PATH)
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from app.routers import auth, preference, category, recommendation_router, destination, review
+from app.supabase_client import close_client
+from recommendation import start_catalog_refresh, stop_catalog_refresh
 
 # For Monitoring
 from prometheus_fastapi_instrumentator import Instrumentator
-from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
-from fastapi.responses import Response
-import sys
-import os
+from fastapi.responses import ORJSONResponse
 
-# Add monitor-source to path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'monitor-source'))
-from collector import start_metrics_collector, stop_metrics_collector
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
 app = FastAPI(
     title="Swisstination API",
     description="Backend API for Swisstination application",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
-# For Monitoring - Set up instrumentator but don't expose yet
+# For Monitoring - one /metrics endpoint serving the default registry
+# (instrumentator metrics + custom metrics registered by monitor-source)
 instrumentator = Instrumentator()
-instrumentator.instrument(app)
+instrumentator.instrument(app).expose(app, endpoint="/metrics", include_in_schema=False)
+
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 app.add_middleware(
     CORSMiddleware,
@@ -38,19 +52,27 @@ app.include_router(recommendation_router.router)
 app.include_router(destination.router)
 app.include_router(review.router)
 
+# Keep the destination catalog used by the recommender fresh in memory
+@app.on_event("startup")
+async def start_catalog():
+    start_catalog_refresh()
+
 # Startup and shutdown events for metrics collector
 @app.on_event("startup")
 async def startup_event():
     """Start metrics collection on application startup"""
+    if not ENABLE_CUSTOM_METRICS:
+        print("📊 ENABLE_CUSTOM_METRICS=0, only FastAPI instrumentator metrics will be available")
+        return
+    
     print("🔍 Starting metrics collector...")
     
     # Import metrics to register them with the default registry
-    monitor_source_path = os.path.join(os.path.dirname(__file__), '..', 'monitor-source')
-    print(f"📂 Looking for monitor-source at: {os.path.abspath(monitor_source_path)}")
+    print(f"📂 Looking for monitor-source at: {MONITOR_SOURCE_PATH}")
     
-    if os.path.exists(monitor_source_path):
-        sys.path.insert(0, monitor_source_path)
+    if os.path.exists(MONITOR_SOURCE_PATH):
         import metrics  # This registers all metrics with the default registry
+        from collector import start_metrics_collector
         print("📊 Custom metrics module imported successfully")
         
         await start_metrics_collector(refresh_interval=30)
@@ -62,9 +84,12 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     """Stop metrics collection on application shutdown"""
-    print("🛑 Stopping metrics collector...")
-    stop_metrics_collector()
-    print("✅ Metrics collector stopped")
+    if "collector" in sys.modules:
+        print("🛑 Stopping metrics collector...")
+        await sys.modules["collector"].stop_metrics_collector()
+        print("✅ Metrics collector stopped")
+    stop_catalog_refresh()
+    await close_client()
 
 @app.get("/")
 async def root():
@@ -74,11 +99,6 @@ async def root():
 async def health_check():
     return {"status": "healthy", "message": "API is running"}
 
-@app.get("/metrics")
-async def get_metrics():
-    """Custom metrics endpoint that includes both instrumentator and custom metrics"""
-    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
-
 if __name__ == "__main__":
     import uvicorn
     
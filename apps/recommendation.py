@@ -1,56 +1,104 @@
 # recommendation.py
+import logging
 import numpy as np
 import pandas as pd
 import joblib
+import json
+import asyncio
+import time
+import threading
+import contextvars
+from functools import lru_cache
+from cachetools import TTLCache
 
 import os
 
+logger = logging.getLogger(__name__)
+
 # Use path that works both locally and in Docker
 # When running locally from the apps directory: "artifacts/model.pkl"
 # When running in Docker (workdir /app, apps copied to .): "artifacts/model.pkl"
 # When running from project root: "apps/artifacts/model.pkl"
-def get_model_path():
+def get_artifact_path(name):
     # Try the direct path first (works in Docker and when running from apps dir)
-    direct_path = os.path.join("artifacts", "model.pkl")
+    direct_path = os.path.join("artifacts", name)
     if os.path.exists(direct_path):
         return direct_path
     
     # Try the full path (works when running from project root)
-    full_path = os.path.join("apps", "artifacts", "model.pkl")
+    full_path = os.path.join("apps", "artifacts", name)
     if os.path.exists(full_path):
         return full_path
     
     # Default to direct path if neither exists (for error handling)
     return direct_path
 
+def get_model_path():
+    return get_artifact_path("model.pkl")
+
 ARTIFACTS_PATH = get_model_path()
+# Faktor .npy + meta.json dari export_serving_artifacts (lebih disukai dari model.pkl)
+SERVING_PATH = get_artifact_path("serving")
+
+def _load_serving_artifacts(path):
+    """Memory-map the factor matrices and read the id maps; no Surprise objects are unpickled."""
+    pu, qi, bu, bi = (np.load(os.path.join(path, f"{k}.npy"), mmap_mode="r") for k in ("pu", "qi", "bu", "bi"))
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    return pu, qi, bu, bi, meta
 
 # ===== Load artifacts sekali di import =====
-print(f"[DEBUG] Looking for model at: {ARTIFACTS_PATH}")
-print(f"[DEBUG] Current working directory: {os.getcwd()}")
-print(f"[DEBUG] Model file exists: {os.path.exists(ARTIFACTS_PATH)}")
+logger.debug("Looking for model at: %s (serving: %s)", ARTIFACTS_PATH, SERVING_PATH)
+logger.debug("Current working directory: %s", os.getcwd())
+logger.debug("Model file exists: %s", os.path.exists(ARTIFACTS_PATH))
 
 try:
-    _pack = joblib.load(ARTIFACTS_PATH)
-    algo = _pack["algo"]
-    trainset = _pack["trainset"]
-    df_items = _pack["items_df"]
-    GLOBAL_MEAN = _pack.get("global_mean", trainset.global_mean)
+    if os.path.isdir(SERVING_PATH):
+        PU, QI, BU, BI, _meta = _load_serving_artifacts(SERVING_PATH)
+        algo = trainset = None
+        item_categories = _meta["item_categories"]
+        GLOBAL_MEAN = _meta["global_mean"]
+        RATING_SCALE = tuple(_meta["rating_scale"])
+        RAW2INNER = {raw: i for i, raw in enumerate(_meta["item_ids"])}
+        RAW2INNER_USERS = {raw: u for u, raw in enumerate(_meta["user_ids"])}
+        INNER2RAW = np.array(_meta["item_ids"], dtype=object)
+    else:
+        _pack = joblib.load(ARTIFACTS_PATH)
+        algo = _pack["algo"]
+        trainset = _pack["trainset"]
+        if "item_categories" in _pack:
+            item_categories = _pack["item_categories"]
+        else:
+            # Artifact lama masih menyimpan items_df
+            _items = _pack["items_df"]
+            item_categories = dict(zip(_items["destinasi_id"].astype(str), _items["kategori_id"].astype(int)))
+        GLOBAL_MEAN = _pack.get("global_mean", trainset.global_mean)
+        RATING_SCALE = trainset.rating_scale
+        # Artifact lama belum menyimpan factors; ambil langsung dari algo
+        _factors = _pack.get("factors") or {k: np.asarray(getattr(algo, k), dtype=np.float32) for k in ("pu", "qi", "bu", "bi")}
+        # Contiguous float32 (SoA) supaya scoring memakai bandwidth sekecil mungkin
+        PU, QI, BU, BI = (np.ascontiguousarray(_factors[k], dtype=np.float32) for k in ("pu", "qi", "bu", "bi"))
+        # Peta id raw <-> inner tanpa lewat method trainset di hot path
+        RAW2INNER = dict(trainset._raw2inner_id_items)
+        RAW2INNER_USERS = dict(trainset._raw2inner_id_users)
+        INNER2RAW = np.empty(len(RAW2INNER), dtype=object)
+        for _raw, _inner in RAW2INNER.items():
+            INNER2RAW[_inner] = _raw
     
     # Debug info about loaded data
-    print(f"[DEBUG] Loaded model artifacts:")
-    print(f"[DEBUG] - df_items shape: {df_items.shape}")
-    print(f"[DEBUG] - Total destinations in model: {len(df_items)}")
-    print(f"[DEBUG] - Available destination IDs: {len(df_items['destinasi_id'].unique())} unique IDs")
-    print(f"[DEBUG] - Categories in model: {sorted(df_items['kategori_id'].unique())}")
+    logger.debug("Loaded model artifacts: %d destinations, categories %s",
+                 len(item_categories), sorted(set(item_categories.values())))
     ML_MODEL_AVAILABLE = True
 except Exception as e:
-    print(f"[WARNING] Could not load ML model: {e}")
-    print("[WARNING] Will use database fallback for all recommendations")
+    logger.warning("Could not load ML model: %s", e)
+    logger.warning("Will use database fallback for all recommendations")
     algo = None
     trainset = None
-    df_items = None
+    item_categories = None
+    PU = QI = BU = BI = None
+    RAW2INNER, RAW2INNER_USERS, INNER2RAW = {}, {}, None
     GLOBAL_MEAN = 3.0  # Default rating
+    RATING_SCALE = (1, 5)
     ML_MODEL_AVAILABLE = False
 
 # Kamu bisa tarik df_ratings terbaru dari DB saat runtime jika mau filter "sudah dirating"
@@ -61,201 +109,356 @@ def fetch_latest_ratings():
 
 df_ratings = fetch_latest_ratings()
 
-# ===== Utilities =====
-def known_item(raw_iid: str) -> bool:
-    # apakah item pernah dilihat saat training
-    if not ML_MODEL_AVAILABLE or trainset is None:
-        return False
-    return raw_iid in trainset._raw2inner_id_items
+# Index df_ratings per user sekali saja, supaya hot path cukup lookup dict
+_rating_users = df_ratings["user_id"].astype(str)
+USER_TAKEN: dict[str, set[str]] = df_ratings["destinasi_id"].astype(str).groupby(_rating_users).apply(set).to_dict()
+USER_COUNTS: dict[str, int] = _rating_users.value_counts().to_dict()
+
+# Katalog destinasi dari DB disimpan di memori dan di-refresh oleh background task,
+# supaya rekomendasi (terutama cold-start) tidak perlu query destinasi sama sekali
+CANDIDATES_TTL = 60
+_catalog = None            # destinasi_id (str) -> kategori_id, urutan sesuai DB
+_cat_index = {}            # kategori_id -> list destinasi_id (str)
+_catalog_loaded_at = 0.0
+CATALOG_VERSION = 0        # naik setiap isi katalog berubah
+_refresh_task = None
+# Set when a DB read failed while building the current recommend() result
+_degraded = contextvars.ContextVar("recommendation_degraded", default=False)
+
+async def refresh_catalog():
+    """
+    Reload destinasi_id/kategori_id from the database and rebuild the per-category
+    index. Returns the catalog, or None if the DB is empty.
+    """
+    global _catalog, _cat_index, _catalog_loaded_at, CATALOG_VERSION
+    from app.supabase_client import select
+    rows = await select("destinasi", "destinasi_id,kategori_id")
+    if not rows:
+        return None
+    catalog = {str(dest["destinasi_id"]): dest["kategori_id"] for dest in rows}
+    cat_index = {}
+    for iid, cat in catalog.items():
+        cat_index.setdefault(cat, []).append(iid)
+    if catalog != _catalog:
+        CATALOG_VERSION += 1
+    _catalog, _cat_index = catalog, cat_index
+    _catalog_loaded_at = time.monotonic()
+    logger.debug("refresh_catalog: %d destinations in %d categories (version %d)", len(catalog), len(cat_index), CATALOG_VERSION)
+    return catalog
+
+async def _refresh_catalog_loop(interval=CANDIDATES_TTL):
+    while True:
+        try:
+            await refresh_catalog()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Catalog refresh failed: %s", e)
+        await asyncio.sleep(interval)
+
+def start_catalog_refresh(interval=CANDIDATES_TTL):
+    """Start the background catalog refresh (call from the app's startup hook)."""
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(_refresh_catalog_loop(interval))
+
+def stop_catalog_refresh():
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        _refresh_task = None
+
+async def _destination_catalog():
+    """
+    destinasi_id (str) -> kategori_id for every destination in the database.
+    Served from memory; only fetched here if the background refresh hasn't run
+    (or has stalled for 2x CANDIDATES_TTL). Returns None if the DB is empty.
+    """
+    if _catalog is not None and time.monotonic() - _catalog_loaded_at < 2 * CANDIDATES_TTL:
+        return _catalog
+    return await refresh_catalog()
 
-def _candidates(restrict_cats=None):
+async def prefetch_catalog():
     """
-    Get candidate destination IDs, preferring fresh database data over ML model data.
-    This ensures we always have the most up-to-date destination list.
+    Warm the destination catalog so a following recommend() call doesn't wait on
+    the DB. Errors are swallowed; _candidates falls back to model data on its own.
     """
     try:
-        # Always try to get fresh data from database first
-        from supabase_client import supabase
-        
-        if supabase is not None:
-            if restrict_cats is not None:
-                result = supabase.table("destinasi").select("destinasi_id").in_("kategori_id", restrict_cats).execute()
+        await _destination_catalog()
+    except Exception as e:
+        logger.debug("prefetch_catalog failed: %s", e)
+
+def _filter_catalog(catalog, restrict_cats=None):
+    if restrict_cats is None:
+        return list(catalog)
+    cats = set(restrict_cats)
+    return [iid for iid, cat in catalog.items() if cat in cats]
+
+async def _candidates(restrict_cats=None):
+    """
+    Get candidate destination IDs, preferring database data over ML model data.
+    Category-restricted lists are concatenated from the in-memory category index.
+    """
+    try:
+        catalog = await _destination_catalog()
+        if catalog:
+            if restrict_cats is None:
+                candidates = list(catalog)
             else:
-                result = supabase.table("destinasi").select("destinasi_id").execute()
-            
-            if result.data:
-                candidates = [str(dest["destinasi_id"]) for dest in result.data]
-                print(f"[DEBUG] _candidates from database: found {len(candidates)} candidates (restrict_cats={restrict_cats})")
-                return candidates
+                cat_index = _cat_index
+                candidates = [iid for cat in dict.fromkeys(restrict_cats) for iid in cat_index.get(cat, ())]
+            logger.debug("_candidates from database: found %d candidates (restrict_cats=%s)", len(candidates), restrict_cats)
+            return candidates
     except Exception as e:
-        print(f"[DEBUG] _candidates: Error fetching from database: {e}, falling back to model data")
+        logger.debug("_candidates: Error fetching from database: %s, falling back to model data", e)
+        _degraded.set(True)
     
     # Fallback to ML model data if database is unavailable
-    if not ML_MODEL_AVAILABLE or df_items is None:
-        print(f"[DEBUG] _candidates: ML model not available, returning empty list")
+    if not ML_MODEL_AVAILABLE or item_categories is None:
+        logger.debug("_candidates: ML model not available, returning empty list")
         return []
     
-    if restrict_cats is not None:
-        candidates = df_items.loc[df_items["kategori_id"].isin(restrict_cats), "destinasi_id"].astype(str).tolist()
-        print(f"[DEBUG] _candidates from model with restrict_cats {restrict_cats}: found {len(candidates)} candidates")
-        return candidates
-    candidates = df_items["destinasi_id"].astype(str).tolist()
-    print(f"[DEBUG] _candidates from model without restriction: found {len(candidates)} total candidates")
+    candidates = _filter_catalog(item_categories, restrict_cats)
+    logger.debug("_candidates from model with restrict_cats %s: found %d candidates", restrict_cats, len(candidates))
     return candidates
 
-def get_all_items_fallback_from_db(restrict_cats=None, n=10):
+async def get_all_items_fallback_from_db(restrict_cats=None, n=10):
     """
     Enhanced fallback function that fetches all destinations directly from the database.
     This ensures we get all current destinations, not just those in the ML model.
     """
     try:
-        # Import here to avoid circular imports
-        from supabase_client import supabase
-        
-        if supabase is None:
-            print("[DEBUG] Supabase not available, falling back to model data")
-            return get_all_items_fallback(restrict_cats, n)
-        
-        # Fetch all destinations from database
-        if restrict_cats is not None:
-            result = supabase.table("destinasi").select("destinasi_id, kategori_id").in_("kategori_id", restrict_cats).execute()
-        else:
-            result = supabase.table("destinasi").select("destinasi_id, kategori_id").execute()
+        catalog = await _destination_catalog()
         
-        if not result.data:
-            print("[DEBUG] No destinations found in database, falling back to model data")
-            return get_all_items_fallback(restrict_cats, n)
+        if not catalog:
+            logger.debug("No destinations found in database, falling back to model data")
+            return await get_all_items_fallback(restrict_cats, n)
         
-        # Create scored items from database results
-        scored_items = []
-        for i, dest in enumerate(result.data):
-            dest_id = str(dest["destinasi_id"])
-            # Simple scoring: descending by order, with some randomness
-            basic_score = 10.0 - (i * 0.05) if i < 200 else 1.0
-            scored_items.append((dest_id, basic_score))
+        # Simple scoring: descending by order
+        dest_ids = _filter_catalog(catalog, restrict_cats)
+        scores = _basic_scores(len(dest_ids), 0.05, 200)
         
-        # Sort by score
-        scored_items.sort(key=lambda x: x[1], reverse=True)
-        
-        print(f"[DEBUG] get_all_items_fallback_from_db: fetched {len(scored_items)} destinations from DB")
+        logger.debug("get_all_items_fallback_from_db: fetched %d destinations from DB", len(dest_ids))
         
         # Return all items if n is large, otherwise return requested count
-        result_items = scored_items if n >= 1000 else scored_items[:n]
-        print(f"[DEBUG] get_all_items_fallback_from_db: returning {len(result_items)} items")
+        result_items = [(dest_ids[i], float(scores[i])) for i in _top_n_positions(scores, n)]
+        logger.debug("get_all_items_fallback_from_db: returning %d items", len(result_items))
         return result_items
         
     except Exception as e:
-        print(f"[DEBUG] Error in get_all_items_fallback_from_db: {e}")
-        print("[DEBUG] Falling back to model data")
-        return get_all_items_fallback(restrict_cats, n)
+        logger.warning("Error in get_all_items_fallback_from_db: %s; falling back to model data", e)
+        _degraded.set(True)
+        return await get_all_items_fallback(restrict_cats, n)
 
-def get_all_items_fallback(restrict_cats=None, n=10):
+async def get_all_items_fallback(restrict_cats=None, n=10):
     """
     Original fallback function that uses ML model data.
     """
-    candidates = _candidates(restrict_cats)
-    print(f"[DEBUG] get_all_items_fallback: processing {len(candidates)} candidates from model, n={n}")
+    candidates = await _candidates(restrict_cats)
+    logger.debug("get_all_items_fallback: processing %d candidates from model, n=%s", len(candidates), n)
     
     # Assign a basic score (could be based on popularity, alphabetical, etc.)
-    # For now, we'll use a simple descending score based on destination_id
-    scored_items = []
-    for i, iid in enumerate(candidates):
-        # Simple scoring: higher score for lower index (you could improve this)
-        basic_score = 10.0 - (i * 0.1) if i < 100 else 1.0
-        scored_items.append((iid, basic_score))
-    
-    # Sort by score (already sorted by index, but keeping it explicit)
-    scored_items.sort(key=lambda x: x[1], reverse=True)
+    # For now: higher score for lower index (you could improve this)
+    scores = _basic_scores(len(candidates), 0.1, 100)
     
     # If n is very large (1000 or more), return all items
-    result = scored_items if n >= 1000 else scored_items[:n]
-    print(f"[DEBUG] get_all_items_fallback: returning {len(result)} items from model")
+    result = [(candidates[i], float(scores[i])) for i in _top_n_positions(scores, n)]
+    logger.debug("get_all_items_fallback: returning %d items from model", len(result))
     return result
 
+def _score_kernel(qi: np.ndarray, bi: np.ndarray, pu: np.ndarray, offset: float, idx: np.ndarray) -> np.ndarray:
+    """offset + bi[i] + qi[i] . pu for every inner item index i in idx (one BLAS GEMV)."""
+    q = qi[idx]
+    scores = q @ pu
+    scores += bi[idx]
+    scores += offset
+    return scores
+
+def predict_scores(user_id: str, inner_iids) -> np.ndarray:
+    """
+    Same estimate as algo.predict(user_id, iid).est for many items at once:
+    global_mean + bu + bi + qi . pu, clipped to the rating scale. The dot
+    products are a single matrix-vector product instead of a Python loop.
+    """
+    idx = np.asarray(inner_iids, dtype=np.intp)
+    inner_uid = RAW2INNER_USERS.get(user_id)
+    if inner_uid is not None:
+        scores = _score_kernel(QI, BI, PU[inner_uid], GLOBAL_MEAN + BU[inner_uid], idx)
+    else:
+        scores = GLOBAL_MEAN + BI[idx]
+    lo, hi = RATING_SCALE
+    return np.clip(scores, lo, hi)
+
+def _known_candidates(iids, exclude=()):
+    """Keep candidates the model has seen (and not excluded); returns raw ids + inner index array."""
+    known = [iid for iid in iids if iid in RAW2INNER and iid not in exclude]
+    return known, np.fromiter((RAW2INNER[iid] for iid in known), dtype=np.intp, count=len(known))
+
+def _top_n_positions(scores: np.ndarray, n):
+    """
+    Positions of the n highest scores, sorted desc (all of them when n >= 1000).
+    Ties keep catalog order, so the flat 1.0 tail of the fallback scores comes back in order.
+    """
+    top = np.argsort(-scores, kind="stable")
+    return top[:n] if n < 1000 else top
+
+def _top_n(idx: np.ndarray, scores: np.ndarray, n):
+    """(raw iid, score) pairs for inner ids idx, sorted by score desc."""
+    top = _top_n_positions(scores, n)
+    return list(zip(INNER2RAW[idx[top]].tolist(), scores[top].tolist()))
+
+def _basic_scores(count: int, step: float, ranked: int) -> np.ndarray:
+    """Fallback scoring: 10 - i*step for the first `ranked` positions, 1.0 afterwards."""
+    i = np.arange(count)
+    return np.where(i < ranked, 10.0 - i * step, 1.0)
+
 # ===== User lama =====
-def topn_for_user(user_id: str, n=10, restrict_cats=None):
+async def topn_for_user(user_id: str, n=10, restrict_cats=None):
     user_id = str(user_id)
-    taken = set(df_ratings.loc[df_ratings["user_id"]==user_id, "destinasi_id"].astype(str))
-    preds = []
-    for iid in _candidates(restrict_cats):
-        if iid in taken or not known_item(iid):
-            continue
-        # Surprise bisa pakai raw id langsung
-        est = algo.predict(user_id, iid).est
-        preds.append((iid, float(est)))
-    preds.sort(key=lambda x: x[1], reverse=True)
+    taken = USER_TAKEN.get(user_id, set())
+    _, idx = _known_candidates(await _candidates(restrict_cats), exclude=taken)
+    if len(idx) == 0:
+        return []
     # If n is very large (1000 or more), return all predictions
-    return preds if n >= 1000 else preds[:n]
+    return _top_n(idx, predict_scores(user_id, idx), n)
 
 # ===== Cold-start: pseudo user dari kategori =====
-def pseudo_user_vector_from_categories(selected_cat_ids: list[int]):
-    qvecs = []
-    cand_items = df_items.loc[df_items["kategori_id"].isin(selected_cat_ids), "destinasi_id"].astype(str).tolist()
-    for iid in cand_items:
-        if known_item(iid):
-            ii = trainset.to_inner_iid(iid)
-            qvecs.append(algo.qi[ii])   # latent vector item
-    if not qvecs:
+def _category_factor_sums():
+    """kategori_id -> (sum of item latent vectors, item count) over items known to the model."""
+    iids, idx = _known_candidates(item_categories)
+    if not iids:
+        return {}
+    cats = np.fromiter((item_categories[iid] for iid in iids), dtype=np.int64, count=len(iids))
+    sums = {}
+    for cat in np.unique(cats):
+        cat_idx = idx[cats == cat]
+        sums[int(cat)] = (QI[cat_idx].sum(axis=0, dtype=np.float64), len(cat_idx))
+    return sums
+
+# Dihitung sekali saat import; query multi-kategori cukup menggabungkan beberapa entri
+CAT_QI_SUMS = _category_factor_sums() if ML_MODEL_AVAILABLE else {}
+
+WARM_UP_ITEMS = 64
+
+def _warm_up_kernel():
+    """
+    Run the scoring kernel once on a few items so BLAS initialisation happens at startup,
+    not on the first request. Kept small so the memory-mapped factors aren't paged in.
+    """
+    if len(QI) == 0:
+        return
+    idx = np.arange(min(WARM_UP_ITEMS, len(QI)))
+    _score_kernel(QI, BI, np.zeros(QI.shape[1], dtype=np.float32), GLOBAL_MEAN, idx)
+
+if ML_MODEL_AVAILABLE:
+    _warm_up_kernel()
+
+@lru_cache(maxsize=256)
+def _pseudo_user_vector(cat_ids: tuple):
+    parts = [CAT_QI_SUMS[c] for c in cat_ids if c in CAT_QI_SUMS]
+    if not parts:
         return None
-    return np.mean(np.stack(qvecs, axis=0), axis=0)
-
-def score_items_for_pseudo_user(pu_vec, exclude=set(), restrict_cats=None, n=10):
-    scored = []
-    for iid in _candidates(restrict_cats):
-        if iid in exclude or not known_item(iid):
-            continue
-        ii = trainset.to_inner_iid(iid)
-        qi = algo.qi[ii]
-        bi = algo.bi[ii]
-        score = GLOBAL_MEAN + bi + float(np.dot(qi, pu_vec))  # bu=0 untuk user baru
-        scored.append((iid, score))
-    scored.sort(key=lambda x: x[1], reverse=True)
+    total = sum(vec for vec, _ in parts)
+    count = sum(cnt for _, cnt in parts)
+    vec = (total / count).astype(np.float32)   # rata-rata latent vector item
+    vec.flags.writeable = False   # shared via the cache
+    return vec
+
+def pseudo_user_vector_from_categories(selected_cat_ids: list[int]):
+    return _pseudo_user_vector(tuple(sorted(set(selected_cat_ids))))
+
+async def score_items_for_pseudo_user(pu_vec, exclude=set(), restrict_cats=None, n=10):
+    _, idx = _known_candidates(await _candidates(restrict_cats), exclude=exclude)
+    if len(idx) == 0:
+        return []
+    scores = _score_kernel(QI, BI, pu_vec, GLOBAL_MEAN, idx)  # bu=0 untuk user baru
     # If n is very large (1000 or more), return all scored items
-    return scored if n >= 1000 else scored[:n]
+    return _top_n(idx, scores, n)
+
+# ===== Cache hasil recommend =====
+RESULTS_TTL = 30
+_results_cache = TTLCache(maxsize=10_000, ttl=RESULTS_TTL)
+_results_lock = threading.RLock()
+# Only needs to outlive the results cached under the previous version, so it shares their TTL
+_user_versions = TTLCache(maxsize=10_000, ttl=RESULTS_TTL)
+
+def invalidate_user_recommendations(user_id):
+    """Drop cached results for a user (e.g. after they rate something) by bumping their version."""
+    user_id = str(user_id)
+    with _results_lock:
+        _user_versions[user_id] = _user_versions.get(user_id, 0) + 1
+
+def _results_key(user_id, selected_cat_ids, n, k_min_interactions):
+    uid = None if user_id is None else str(user_id)
+    cats = None if selected_cat_ids is None else tuple(sorted(set(selected_cat_ids)))
+    # Versi user & katalog ikut di key, jadi entri lama otomatis tidak terpakai lagi
+    return (uid, _user_versions.get(uid, 0), CATALOG_VERSION, cats, n, k_min_interactions)
 
 # ===== Wrapper satu pintu =====
-def recommend(user_id: str | None, selected_cat_ids: list[int] | None, n=10, k_min_interactions=3):
+async def recommend(user_id: str | None, selected_cat_ids: list[int] | None, n=10, k_min_interactions=3):
+    """
+    Cached front of _recommend: identical (user, categories, n) requests within
+    RESULTS_TTL seconds reuse the previous result.
+    """
+    with _results_lock:
+        key = _results_key(user_id, selected_cat_ids, n, k_min_interactions)
+        cached = _results_cache.get(key)
+    if cached is not None:
+        logger.debug("recommend cache hit for user_id=%s", user_id)
+        return list(cached)
+    token = _degraded.set(False)
+    try:
+        result = await _recommend(user_id, selected_cat_ids, n=n, k_min_interactions=k_min_interactions)
+        # Don't pin a result built around a DB error for the whole TTL
+        if not _degraded.get():
+            with _results_lock:
+                _results_cache[key] = result
+    finally:
+        _degraded.reset(token)
+    return list(result)
+
+async def _recommend(user_id: str | None, selected_cat_ids: list[int] | None, n=10, k_min_interactions=3):
     """
     - Jika user punya >=k interaksi → pakai topn_for_user
     - Jika belum → pakai pseudo-user vector dari kategori (cold-start)
     - Fallback populer per kategori jika tak ada vektor pseudo yang valid
     """
-    print(f"[DEBUG] recommend called with user_id={user_id}, selected_cat_ids={selected_cat_ids}, n={n}")
+    logger.debug("recommend called with user_id=%s, selected_cat_ids=%s, n=%s", user_id, selected_cat_ids, n)
     
     # If ML model is not available, use database fallback directly
     if not ML_MODEL_AVAILABLE:
-        print(f"[DEBUG] ML model not available, using database fallback directly")
-        return get_all_items_fallback_from_db(restrict_cats=selected_cat_ids, n=n)
+        logger.debug("ML model not available, using database fallback directly")
+        return await get_all_items_fallback_from_db(restrict_cats=selected_cat_ids, n=n)
     
     # hitung interaksi user (pakai df_ratings yang ideally ditarik dari DB terbaru)
     if user_id is not None:
         user_id = str(user_id)
-        n_inter = (df_ratings["user_id"].astype(str) == user_id).sum()
-        print(f"[DEBUG] User {user_id} has {n_inter} interactions")
+        n_inter = USER_COUNTS.get(user_id, 0)
+        logger.debug("User %s has %d interactions", user_id, n_inter)
         if n_inter >= k_min_interactions:
-            print(f"[DEBUG] Using topn_for_user for user {user_id}")
-            return topn_for_user(user_id, n=n, restrict_cats=selected_cat_ids)
+            logger.debug("Using topn_for_user for user %s", user_id)
+            return await topn_for_user(user_id, n=n, restrict_cats=selected_cat_ids)
 
     # cold-start
     if selected_cat_ids:
-        print(f"[DEBUG] Trying cold-start for categories {selected_cat_ids}")
+        logger.debug("Trying cold-start for categories %s", selected_cat_ids)
         pu = pseudo_user_vector_from_categories(selected_cat_ids)
         if pu is not None:
-            print(f"[DEBUG] Using pseudo-user vector for cold-start")
-            return score_items_for_pseudo_user(pu, restrict_cats=selected_cat_ids, n=n)
+            logger.debug("Using pseudo-user vector for cold-start")
+            return await score_items_for_pseudo_user(pu, restrict_cats=selected_cat_ids, n=n)
         else:
-            print(f"[DEBUG] Pseudo-user vector is None, falling back")
+            logger.debug("Pseudo-user vector is None, falling back")
 
     # fallback: return all destinations with basic scoring from database
     # This ensures users always see all available destinations
-    print(f"[DEBUG] Using fallback recommendations from database")
-    return get_all_items_fallback_from_db(restrict_cats=selected_cat_ids, n=n)
+    logger.debug("Using fallback recommendations from database")
+    return await get_all_items_fallback_from_db(restrict_cats=selected_cat_ids, n=n)
 
 # ======= Contoh pemakaian langsung (opsional) =======
 if __name__ == "__main__":
     # Contoh: user baru pilih kategori [3,5,6]
     cats = [3,5,6,1]
-    print("Cold-start:", recommend(user_id=None, selected_cat_ids=cats, n=5))
+    print("Cold-start:", asyncio.run(recommend(user_id=None, selected_cat_ids=cats, n=5)))
 
     # Contoh: user lama (ganti '123' sesuai data di DB & pastikan df_ratings diisi dari DB)
-    print("User lama:", recommend(user_id="123", selected_cat_ids=None, n=5))
+    print("User lama:", asyncio.run(recommend(user_id="123", selected_cat_ids=None, n=5)))
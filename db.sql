@@ -41,6 +41,104 @@ CREATE TABLE public.ratings (
   created_at timestamp with time zone DEFAULT now(),
   review text,
   CONSTRAINT ratings_pkey PRIMARY KEY (rating_id),
+  CONSTRAINT ratings_user_destinasi_key UNIQUE (user_id, destinasi_id),
   CONSTRAINT ratings_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.custom_users(user_id),
   CONSTRAINT ratings_destinasi_id_fkey FOREIGN KEY (destinasi_id) REFERENCES public.destinasi(destinasi_id)
-);
\ No newline at end of file
+);
+
+-- All ratings as one JSON object of column arrays, so the trainer fetches
+-- them in a single request regardless of PostgREST's max-rows setting.
+CREATE OR REPLACE FUNCTION public.get_all_ratings()
+RETURNS json
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT json_build_object(
+    'user_id', coalesce(array_agg(user_id ORDER BY rating_id), '{}'),
+    'destinasi_id', coalesce(array_agg(destinasi_id ORDER BY rating_id), '{}'),
+    'rating', coalesce(array_agg(rating ORDER BY rating_id), '{}')
+  )
+  FROM public.ratings;
+$$;
+
+-- Row count estimate from pg_class (like PostgREST's count=estimated): small or
+-- never-analyzed tables fall back to an exact count, which is cheap for them.
+CREATE OR REPLACE FUNCTION public.monitor_estimated_count(tbl regclass)
+RETURNS bigint
+LANGUAGE plpgsql
+STABLE
+AS $$
+DECLARE
+  est bigint;
+BEGIN
+  SELECT reltuples::bigint INTO est FROM pg_class WHERE oid = tbl;
+  IF est IS NULL OR est < 10000 THEN
+    EXECUTE format('SELECT count(*) FROM %s', tbl) INTO est;
+  END IF;
+  RETURN est;
+END;
+$$;
+
+-- Every count the metrics collector exports, in one round-trip. only_keys limits
+-- the result to the counts that are due; NULL returns all of them.
+CREATE OR REPLACE FUNCTION public.get_monitor_counts(only_keys text[] DEFAULT NULL)
+RETURNS json
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT json_strip_nulls(json_build_object(
+    'users', CASE WHEN only_keys IS NULL OR 'users' = ANY(only_keys)
+      THEN public.monitor_estimated_count('public.custom_users') END,
+    'preferences', CASE WHEN only_keys IS NULL OR 'preferences' = ANY(only_keys)
+      THEN public.monitor_estimated_count('public.preference') END,
+    'destinations', CASE WHEN only_keys IS NULL OR 'destinations' = ANY(only_keys)
+      THEN public.monitor_estimated_count('public.destinasi') END,
+    'categories', CASE WHEN only_keys IS NULL OR 'categories' = ANY(only_keys)
+      THEN public.monitor_estimated_count('public.category') END,
+    'reviews', CASE WHEN only_keys IS NULL OR 'reviews' = ANY(only_keys)
+      THEN public.monitor_estimated_count('public.ratings') END
+  ));
+$$;
+
+-- Push row count changes to the metrics collector (LISTEN metric_counts) so it
+-- doesn't have to poll; payload is '<table>:+1' or '<table>:-1'.
+CREATE OR REPLACE FUNCTION public.notify_metric_counts()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  PERFORM pg_notify('metric_counts', TG_TABLE_NAME || CASE WHEN TG_OP = 'INSERT' THEN ':+1' ELSE ':-1' END);
+  RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER custom_users_metric_counts AFTER INSERT OR DELETE ON public.custom_users
+  FOR EACH ROW EXECUTE FUNCTION public.notify_metric_counts();
+CREATE TRIGGER preference_metric_counts AFTER INSERT OR DELETE ON public.preference
+  FOR EACH ROW EXECUTE FUNCTION public.notify_metric_counts();
+CREATE TRIGGER destinasi_metric_counts AFTER INSERT OR DELETE ON public.destinasi
+  FOR EACH ROW EXECUTE FUNCTION public.notify_metric_counts();
+CREATE TRIGGER category_metric_counts AFTER INSERT OR DELETE ON public.category
+  FOR EACH ROW EXECUTE FUNCTION public.notify_metric_counts();
+CREATE TRIGGER ratings_metric_counts AFTER INSERT OR DELETE ON public.ratings
+  FOR EACH ROW EXECUTE FUNCTION public.notify_metric_counts();
+
+-- Cumulative insert/update/delete counters per counted table, plus the (auto)analyze
+-- and (auto)vacuum counters: for large tables monitor_estimated_count reads
+-- reltuples, which only changes when one of those runs, so an ANALYZE must also move
+-- the epoch. The collector only re-counts a table when its value moved since the
+-- last refresh.
+CREATE OR REPLACE FUNCTION public.get_mutation_counts()
+RETURNS json
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT json_object_agg(
+    relname,
+    n_tup_ins + n_tup_upd + n_tup_del
+      + analyze_count + autoanalyze_count + vacuum_count + autovacuum_count
+  )
+  FROM pg_stat_user_tables
+  WHERE schemaname = 'public'
+    AND relname IN ('custom_users', 'preference', 'destinasi', 'category', 'ratings');
+$$;
@@ -1,28 +1,30 @@
 import asyncio
+import contextlib
+import random
 import time
 import logging
 import psutil
+import httpx
 import os
 import sys
 from typing import Optional
 
-# Configure logging first
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Add the parent directory to the path to import supabase_client
-apps_path = os.path.join(os.path.dirname(__file__), '..', 'apps')
-if not os.path.exists(apps_path):
-    # Try Docker path structure
-    apps_path = os.path.join(os.path.dirname(__file__), '..', 'app')
-    if not os.path.exists(apps_path):
-        # Try current directory (if running from apps directory)
-        apps_path = os.path.dirname(__file__)
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
 
-sys.path.insert(0, apps_path)
+# Make the apps directory importable for standalone runs. Inside the API (and in Docker,
+# where apps/ is the working directory) `app` is already importable and this is a no-op
+# lookup; set APPS_PATH if the layout differs.
+apps_path = os.environ.get("APPS_PATH") or os.path.join(os.path.dirname(__file__), '..', 'apps')
+if apps_path not in sys.path:
+    sys.path.append(apps_path)
 
 try:
-    from supabase_client import supabase
+    from app.supabase_client import supabase, run_query
     logger.info(f"✅ Supabase client imported successfully from {apps_path}")
 except ImportError as e:
     logger.error(f"❌ Failed to import supabase_client: {e}")
@@ -38,11 +40,83 @@ from metrics import (
     categories_total,
     db_connections_total,
     memory_usage_bytes,
-    update_app_uptime,
+    app_uptime_seconds,
     record_error,
-    record_db_query
+    record_db_query,
+    register_db_queries
 )
 
+try:
+    from postgrest.exceptions import APIError
+except ImportError:
+    APIError = None
+
+
+def _is_transient(error: Exception) -> bool:
+    """Timeouts/connection errors and 5xx responses are worth retrying; other errors aren't"""
+    if isinstance(error, httpx.TransportError):  # includes httpx timeouts
+        return True
+    if APIError is not None and isinstance(error, APIError):
+        code = str(error.code or "")
+        # Plain HTTP 5xx status, or PostgREST's PGRST000-003 connection/pool errors (503/504)
+        return (len(code) == 3 and code.startswith("5")) or code in ("PGRST000", "PGRST001", "PGRST002", "PGRST003")
+    return False
+
+# RPCs the collector issues (see db.sql); their query metric series are created up front
+MONITOR_COUNTS_RPC = "get_monitor_counts"
+MUTATION_COUNTS_RPC = "get_mutation_counts"
+register_db_queries(((MONITOR_COUNTS_RPC, "rpc"), (MUTATION_COUNTS_RPC, "rpc")))
+
+# get_monitor_counts() key -> gauge
+DB_COUNT_GAUGES = {
+    "users": active_users_total,
+    "preferences": user_preferences_total,
+    "destinations": destinations_total,
+    "categories": categories_total,
+    "reviews": reviews_total,
+}
+
+# Direct Postgres connection (session mode, LISTEN doesn't work through a transaction
+# pooler) for push-based count updates; without it the counts are polled
+DATABASE_URL = os.getenv("DATABASE_URL")
+LISTEN_CHANNEL = "metric_counts"
+
+# Table name in NOTIFY payloads -> get_monitor_counts() key
+TABLE_METRIC_KEYS = {
+    "custom_users": "users",
+    "preference": "preferences",
+    "destinasi": "destinations",
+    "category": "categories",
+    "ratings": "reviews",
+}
+
+# While the listener is connected the counts are pushed; polling only resyncs them this often
+PUSH_RESYNC_INTERVAL = 86400
+
+# Counts of tables without inserts/updates/deletes since their last refresh are skipped,
+# but still re-counted at least this often as a safety net
+MUTATION_SAFETY_INTERVAL = 86400
+
+# Max Supabase requests the collector keeps in flight, so it never takes more than
+# a small share of the shared connection pool away from API handlers
+DB_CONCURRENCY = 3
+
+# Retry policy for collector queries (the per-request timeout is SUPABASE_TIMEOUT on
+# the shared httpx client, see app.supabase_client)
+DB_RETRIES = 3
+DB_BACKOFF_BASE = 0.5
+
+# Refresh interval per metric in seconds; rarely-changing tables are counted less often.
+# None = use the collector's refresh_interval.
+METRIC_INTERVALS = {
+    "users": None,
+    "preferences": None,
+    "reviews": 60,
+    "destinations": 300,
+    "categories": 3600,
+    "system": 15,
+}
+
 
 class MetricsCollector:
     def __init__(self, refresh_interval: int = 30):
@@ -53,113 +127,208 @@ class MetricsCollector:
             refresh_interval: How often to refresh metrics in seconds
         """
         self.refresh_interval = refresh_interval
-        self.start_time = time.time()
+        # All interval/duration math is monotonic
+        self.start_mono = time.monotonic()
         self.is_running = False
-        
-    async def collect_user_metrics(self):
-        """Collect user-related metrics from Supabase"""
-        try:
-            start_time = time.time()
-            
-            # Count total users
-            result = supabase.table("custom_users").select("user_id", count="exact").execute()
-            if result.data is not None:
-                active_users_total.set(result.count or 0)
-            
-            # Count user preferences
-            pref_result = supabase.table("preference").select("user_id", count="exact").execute()
-            if pref_result.data is not None:
-                user_preferences_total.set(pref_result.count or 0)
-            
-            duration = time.time() - start_time
-            record_db_query("custom_users", "select", duration)
-            record_db_query("preference", "select", duration)
-            
-            logger.info(f"Collected user metrics: {result.count or 0} users, {pref_result.count or 0} preferences")
-            
-        except Exception as e:
-            logger.error(f"Error collecting user metrics: {e}")
-            record_error("user_metrics_collection", "error")
+        self._intervals = {name: interval or refresh_interval for name, interval in METRIC_INTERVALS.items()}
+        self._poll_intervals = dict(self._intervals)
+        self._listener_task: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+        # Set on stop so sleeping loops wake up immediately instead of finishing their interval
+        self._stop_event = asyncio.Event()
+        self._last_run: dict[str, float] = {}
+        # Random phase per metric so replicas (and restarts) don't all query at the same second
+        self._jitter = {name: random.uniform(0, interval) for name, interval in self._intervals.items()}
+        # Loop wakes up as often as the most frequent metric needs
+        self._tick = min(self._intervals.values())
+        # One Process handle for the collector's lifetime; memory_info pre-bound for the hot loop
+        self._process = psutil.Process(os.getpid())
+        self._memory_info = self._process.memory_info
+        self._sem = asyncio.Semaphore(DB_CONCURRENCY)
+        # Last value written per gauge, to skip no-op sets
+        self._last: dict[int, float] = {}
+        # Per count key: mutation counter seen at the last refresh, and when that was
+        self._last_mutation: dict[str, int] = {}
+        self._last_count_refresh: dict[str, float] = {}
+    
+    def _set(self, gauge, value):
+        """Set a gauge only if the value changed since the last write"""
+        if self._last.get(id(gauge)) != value:
+            gauge.set(value)
+            self._last[id(gauge)] = value
+    
+    async def _db_call(self, table: str, operation: str, query):
+        """
+        Execute a Supabase query off the event loop, bounded by the collector semaphore,
+        and record its own duration (time spent waiting for the semaphore excluded).
+        Each attempt is capped by the httpx client timeout, so the semaphore slot is held
+        until the worker thread has really finished. Transient errors (timeouts, transport
+        errors, 5xx) are retried with exponential backoff + jitter.
+        """
+        for attempt in range(DB_RETRIES + 1):
+            try:
+                async with self._sem:
+                    start_time = time.monotonic()
+                    result = await run_query(query)
+                    record_db_query(table, operation, time.monotonic() - start_time)
+                    return result
+            except Exception as e:
+                if attempt == DB_RETRIES or not _is_transient(e):
+                    raise
+                delay = min(30, DB_BACKOFF_BASE * 2 ** attempt) + random.uniform(0, 1)
+                logger.warning(f"{table} {operation} failed ({e!r}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+    
+    async def _wait(self, seconds: float):
+        """Sleep for up to `seconds`, returning early when the collector is stopped"""
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._stop_event.wait(), timeout=seconds)
     
-    async def collect_destination_metrics(self):
-        """Collect destination-related metrics from Supabase"""
+    def _due_metrics(self, now: float) -> list:
+        """Names of metrics whose refresh interval has elapsed"""
+        return [
+            name for name, interval in self._intervals.items()
+            if name not in self._last_run or now - self._last_run[name] >= interval
+        ]
+        
+    async def _mutated_keys(self, keys: list):
+        """
+        Narrow keys to tables mutated or re-analyzed since their last refresh (or due for
+        the safety-net refresh), using one get_mutation_counts() RPC. Returns (keys,
+        mutation counters).
+        """
         try:
-            start_time = time.time()
-            
-            # Count total destinations
-            dest_result = supabase.table("destinasi").select("destinasi_id", count="exact").execute()
-            if dest_result.data is not None:
-                destinations_total.set(dest_result.count or 0)
-            
-            # Count categories
-            cat_result = supabase.table("category").select("kategori_id", count="exact").execute()
-            if cat_result.data is not None:
-                categories_total.set(cat_result.count or 0)
-            
-            duration = time.time() - start_time
-            record_db_query("destinasi", "select", duration)
-            record_db_query("category", "select", duration)
-            
-            logger.info(f"Collected destination metrics: {dest_result.count or 0} destinations, {cat_result.count or 0} categories")
-            
+            result = await self._db_call(MUTATION_COUNTS_RPC, "rpc", supabase.rpc(MUTATION_COUNTS_RPC))
         except Exception as e:
-            logger.error(f"Error collecting destination metrics: {e}")
-            record_error("destination_metrics_collection", "error")
+            logger.warning(f"Could not read mutation counts, refreshing all due counts: {e}")
+            record_error("mutation_counts", "warning")
+            return keys, {}
+        
+        epochs = {TABLE_METRIC_KEYS[table]: value for table, value in (result.data or {}).items() if table in TABLE_METRIC_KEYS}
+        now = time.monotonic()
+        changed = [
+            key for key in keys
+            if epochs.get(key) is None
+            or epochs[key] != self._last_mutation.get(key)
+            or now - self._last_count_refresh.get(key, float("-inf")) >= MUTATION_SAFETY_INTERVAL
+        ]
+        return changed, epochs
     
-    async def collect_review_metrics(self):
-        """Collect review-related metrics from Supabase"""
+    async def collect_db_metrics(self, keys: Optional[list] = None) -> dict:
+        """
+        Fetch table counts from Supabase with one get_monitor_counts() RPC (all if keys is None).
+        Tables that haven't changed since their last refresh are skipped.
+        Returns {gauge: value}; gauges are set by collect_all_metrics.
+        """
         try:
-            start_time = time.time()
+            keys, epochs = await self._mutated_keys(list(DB_COUNT_GAUGES) if keys is None else keys)
+            if not keys:
+                logger.debug("No table mutations since last refresh, skipping DB counts")
+                return {}
             
-            # Count total reviews/ratings
-            review_result = supabase.table("ratings").select("rating_id", count="exact").execute()
-            if review_result.data is not None:
-                reviews_total.set(review_result.count or 0)
+            result = await self._db_call(
+                MONITOR_COUNTS_RPC, "rpc",
+                supabase.rpc(MONITOR_COUNTS_RPC, {"only_keys": keys})
+            )
+            counts = result.data or {}
             
-            duration = time.time() - start_time
-            record_db_query("ratings", "select", duration)
+            now = time.monotonic()
+            for key in counts:
+                self._last_mutation[key] = epochs.get(key)
+                self._last_count_refresh[key] = now
             
-            logger.info(f"Collected review metrics: {review_result.count or 0} reviews")
+            logger.info(f"Collected DB metrics: {counts}")
+            return {gauge: counts[key] for key, gauge in DB_COUNT_GAUGES.items() if counts.get(key) is not None}
             
         except Exception as e:
-            logger.error(f"Error collecting review metrics: {e}")
-            record_error("review_metrics_collection", "error")
+            logger.error(f"Error collecting DB metrics: {e}")
+            record_error("db_metrics_collection", "error")
+            return {}
     
-    async def collect_system_metrics(self):
-        """Collect system-related metrics"""
+    async def collect_system_metrics(self) -> dict:
+        """Collect system-related metrics as {gauge: value}"""
         try:
-            # Update memory usage
-            process = psutil.Process()
-            memory_info = process.memory_info()
-            memory_usage_bytes.set(memory_info.rss)
-            
-            # Update uptime
-            update_app_uptime(self.start_time)
-            
-            # Simulate database connection count (you can implement actual connection pooling metrics)
-            db_connections_total.set(1)  # For now, showing 1 active connection
-            
-            logger.info(f"Collected system metrics: {memory_info.rss} bytes memory")
+            rss = self._memory_info().rss
+            logger.info(f"Collected system metrics: {rss} bytes memory")
+            return {
+                memory_usage_bytes: rss,
+                app_uptime_seconds: time.monotonic() - self.start_mono,
+                # Simulate database connection count (you can implement actual connection pooling metrics)
+                db_connections_total: 1,  # For now, showing 1 active connection
+            }
             
         except Exception as e:
             logger.error(f"Error collecting system metrics: {e}")
             record_error("system_metrics_collection", "error")
+            return {}
     
-    async def collect_all_metrics(self):
-        """Collect all metrics from various sources"""
-        if supabase is None:
-            logger.warning("Supabase client not available, skipping database metrics")
-            await self.collect_system_metrics()
-            return
+    def _set_push_mode(self, enabled: bool):
+        """Move DB counts between polling and push (listener) refresh"""
+        for key in DB_COUNT_GAUGES:
+            self._intervals[key] = PUSH_RESYNC_INTERVAL if enabled else self._poll_intervals[key]
+    
+    def _on_count_notify(self, connection, pid, channel, payload):
+        """asyncpg listener callback: apply a '<table>:+1' / '<table>:-1' delta to its gauge"""
+        table, _, delta = payload.partition(":")
+        gauge = DB_COUNT_GAUGES.get(TABLE_METRIC_KEYS.get(table))
+        current = self._last.get(id(gauge)) if gauge is not None else None
+        if current is None:
+            return  # not bootstrapped yet; the baseline query will include this row
+        self._set(gauge, current + int(delta))
+    
+    async def _listen_loop(self):
+        """Keep a LISTEN connection open; counts are pushed while it is up and polled otherwise"""
+        delay = 1
+        while self.is_running:
+            connection = None
+            try:
+                connection = await asyncpg.connect(DATABASE_URL)
+                await connection.add_listener(LISTEN_CHANNEL, self._on_count_notify)
+                # Baseline once subscribed, so no change slips between the two. Deltas can
+                # only be applied on top of a known value, so stay in polling mode (and
+                # retry the listener) until every count gauge has one
+                await self.collect_all_metrics(list(DB_COUNT_GAUGES))
+                if any(self._last.get(id(gauge)) is None for gauge in DB_COUNT_GAUGES.values()):
+                    raise RuntimeError("baseline count query failed")
+                self._set_push_mode(True)
+                logger.info(f"Listening for row count changes on '{LISTEN_CHANNEL}'")
+                delay = 1
+                while self.is_running and not connection.is_closed():
+                    await self._wait(self._tick)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Count listener error: {e}")
+                record_error("count_listener", "error")
+            finally:
+                self._set_push_mode(False)
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            await self._wait(delay)
+            delay = min(delay * 2, 60)
+    
+    async def collect_all_metrics(self, names: Optional[list] = None):
+        """Collect the given metrics (all of them if names is None) from various sources"""
+        if names is None:
+            names = list(self._intervals)
+        db_keys = [name for name in names if name in DB_COUNT_GAUGES]
+        
+        tasks = []
+        if "system" in names:
+            tasks.append(self.collect_system_metrics())
+        if db_keys:
+            if supabase is None:
+                logger.warning("Supabase client not available, skipping database metrics")
+            else:
+                tasks.append(self.collect_db_metrics(db_keys))
         
         try:
-            # Collect all metrics concurrently
-            await asyncio.gather(
-                self.collect_user_metrics(),
-                self.collect_destination_metrics(),
-                self.collect_review_metrics(),
-                self.collect_system_metrics()
-            )
+            # Collect all values concurrently, then publish them together so a scrape
+            # never sees a half-updated snapshot
+            results = await asyncio.gather(*tasks)
+            for values in results:
+                for gauge, value in values.items():
+                    self._set(gauge, value)
             
         except Exception as e:
             logger.error(f"Error during metrics collection: {e}")
@@ -168,12 +337,30 @@ class MetricsCollector:
     async def start_collection_loop(self):
         """Start the continuous metrics collection loop"""
         self.is_running = True
-        logger.info(f"Starting metrics collection loop with {self.refresh_interval}s interval")
+        logger.info(f"Starting metrics collection loop with intervals {self._intervals}")
         
+        if DATABASE_URL and asyncpg is not None and supabase is not None:
+            self._listener_task = asyncio.create_task(self._listen_loop())
+        
+        # Fixed cadence: ticks are scheduled on a monotonic deadline, so collection time
+        # doesn't stretch the period. Due checks use the scheduled tick time, not "now".
+        next_deadline = time.monotonic()
         while self.is_running:
             try:
-                await self.collect_all_metrics()
-                await asyncio.sleep(self.refresh_interval)
+                tick_time = next_deadline
+                due = self._due_metrics(tick_time)
+                if due:
+                    await self.collect_all_metrics(due)
+                    for name in due:
+                        # First run happens immediately; the jitter then shifts later runs
+                        self._last_run[name] = tick_time - self._jitter.pop(name, 0.0)
+                
+                next_deadline += self._tick
+                now = time.monotonic()
+                if now - next_deadline >= self._tick:
+                    # Overran by more than a whole tick: skip the missed ticks instead of bursting
+                    next_deadline += (now - next_deadline) // self._tick * self._tick
+                await self._wait(max(0.0, next_deadline - now))
                 
             except asyncio.CancelledError:
                 logger.info("Metrics collection loop cancelled")
@@ -181,12 +368,31 @@ class MetricsCollector:
             except Exception as e:
                 logger.error(f"Unexpected error in collection loop: {e}")
                 record_error("collection_loop", "critical")
-                await asyncio.sleep(self.refresh_interval)
+                next_deadline = time.monotonic() + self._tick
+                await self._wait(self._tick)
+    
+    def start(self):
+        """Run the collection loop as a background task (reference kept so it isn't GC'd)"""
+        self._task = asyncio.create_task(self.start_collection_loop())
     
     def stop_collection(self):
         """Stop the metrics collection loop"""
         self.is_running = False
+        self._stop_event.set()
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            self._listener_task = None
         logger.info("Stopping metrics collection loop")
+    
+    async def stop(self):
+        """Stop the loop and wait for its task (and the listener) to finish"""
+        tasks = [task for task in (self._task, self._listener_task) if task is not None]
+        self.stop_collection()
+        for task in tasks:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._task = None
 
 # Global collector instance
 collector_instance: Optional[MetricsCollector] = None
@@ -202,16 +408,16 @@ async def start_metrics_collector(refresh_interval: int = 30):
     collector_instance = MetricsCollector(refresh_interval)
     
     # Start the collection loop as a background task
-    asyncio.create_task(collector_instance.start_collection_loop())
+    collector_instance.start()
     
     logger.info("Metrics collector started successfully")
 
-def stop_metrics_collector():
-    """Stop the metrics collector"""
+async def stop_metrics_collector():
+    """Stop the metrics collector and wait for its background task to exit"""
     global collector_instance
     
     if collector_instance is not None:
-        collector_instance.stop_collection()
+        await collector_instance.stop()
         collector_instance = None
         logger.info("Metrics collector stopped")
 
@@ -222,6 +428,8 @@ async def collect_metrics_once():
     await collector.collect_all_metrics()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    
     # Run collector for testing
     async def main():
         await collect_metrics_once()
@@ -1,6 +1,18 @@
 from prometheus_client import Gauge, Counter, Histogram
+import logging
+import os
 import time
 
+logger = logging.getLogger(__name__)
+
+# The collector runs in-process with a single uvicorn worker, so metric values are
+# plain in-memory atomics. If PROMETHEUS_MULTIPROC_DIR is set, prometheus_client
+# switches every write to mmap'd files; the DB count gauges are then identical in
+# every worker, so they are aggregated with livemax instead of one series per pid.
+MULTIPROCESS = os.environ.get("PROMETHEUS_MULTIPROC_DIR") is not None
+if MULTIPROCESS:
+    logger.warning("PROMETHEUS_MULTIPROC_DIR is set; metrics use file-backed multiprocess values")
+
 # Database metrics
 db_connections_total = Gauge(
     'db_connections_total',
@@ -10,7 +22,8 @@ db_connections_total = Gauge(
 db_query_duration = Histogram(
     'db_query_duration_seconds',
     'Time spent on database queries',
-    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    ['table', 'operation'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
 )
 
 db_queries_total = Counter(
@@ -22,23 +35,33 @@ db_queries_total = Counter(
 # Application metrics
 active_users_total = Gauge(
     'active_users_total',
-    'Total number of active users'
+    'Total number of active users',
+    multiprocess_mode='livemax'
 )
 
 destinations_total = Gauge(
     'destinations_total',
-    'Total number of destinations in database'
+    'Total number of destinations in database',
+    multiprocess_mode='livemax'
 )
 
 reviews_total = Gauge(
     'reviews_total',
-    'Total number of reviews in database'
+    'Total number of reviews in database',
+    multiprocess_mode='livemax'
 )
 
+# No per-user label: one series per user would grow with the user base.
+# The per-user distribution is a histogram with a fixed set of buckets instead.
 recommendations_generated = Counter(
     'recommendations_generated_total',
-    'Total number of recommendations generated',
-    ['user_id']
+    'Total number of recommendations generated'
+)
+
+recommendations_per_user = Histogram(
+    'recommendations_per_user',
+    'Recommendations returned to a user per request',
+    buckets=(1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
 )
 
 # API metrics
@@ -82,12 +105,14 @@ memory_usage_bytes = Gauge(
 # Business metrics
 user_preferences_total = Gauge(
     'user_preferences_total',
-    'Total number of user preferences set'
+    'Total number of user preferences set',
+    multiprocess_mode='livemax'
 )
 
 categories_total = Gauge(
     'categories_total',
-    'Total number of destination categories'
+    'Total number of destination categories',
+    multiprocess_mode='livemax'
 )
 
 # Error metrics
@@ -98,15 +123,48 @@ errors_total = Counter(
 )
 
 # Custom metrics helper functions
+# Bound label children per label tuple, so hot record_* calls skip .labels() lookups
+_DB_CHILDREN = {}
+_API_CHILDREN = {}
+
+def _db_children(table: str, operation: str):
+    key = (table, operation)
+    children = _DB_CHILDREN.get(key)
+    if children is None:
+        children = _DB_CHILDREN[key] = (
+            db_queries_total.labels(table=table, operation=operation),
+            db_query_duration.labels(table=table, operation=operation),
+        )
+    return children
+
+def register_db_queries(queries):
+    """Create label children for known (table, operation) pairs so they are exported from the first scrape"""
+    for table, operation in queries:
+        _db_children(table, operation)
+
 def record_db_query(table: str, operation: str, duration: float):
     """Record database query metrics"""
-    db_queries_total.labels(table=table, operation=operation).inc()
-    db_query_duration.observe(duration)
+    count, hist = _db_children(table, operation)
+    count.inc()
+    hist.observe(duration)
+
+def record_recommendations(count: int):
+    """Record recommendations served to one user in one request"""
+    recommendations_generated.inc(count)
+    recommendations_per_user.observe(count)
 
 def record_api_request(method: str, endpoint: str, status_code: int, duration: float):
     """Record API request metrics"""
-    api_requests_total.labels(method=method, endpoint=endpoint, status_code=status_code).inc()
-    api_request_duration.labels(method=method, endpoint=endpoint).observe(duration)
+    key = (method, endpoint, status_code)
+    children = _API_CHILDREN.get(key)
+    if children is None:
+        children = _API_CHILDREN[key] = (
+            api_requests_total.labels(method=method, endpoint=endpoint, status_code=status_code),
+            api_request_duration.labels(method=method, endpoint=endpoint),
+        )
+    count, hist = children
+    count.inc()
+    hist.observe(duration)
 
 def record_login_attempt(success: bool):
     """Record login attempt metrics"""
@@ -123,13 +181,20 @@ def record_error(error_type: str, severity: str = "error"):
     errors_total.labels(type=error_type, severity=severity).inc()
 
 def update_app_uptime(start_time: float):
-    """Update application uptime"""
-    uptime = time.time() - start_time
+    """Update application uptime (start_time is a time.monotonic() timestamp)"""
+    uptime = time.monotonic() - start_time
     app_uptime_seconds.set(uptime)
 
 # Initialize some metrics with default values so they appear immediately
+_initialized = False
+
 def initialize_metrics():
-    """Initialize metrics with default values"""
+    """Initialize metrics with default values (single-process in-memory values, see MULTIPROCESS)"""
+    global _initialized
+    if _initialized:
+        return
+    _initialized = True
+    
     # Set initial values for gauges
     active_users_total.set(0)
     destinations_total.set(0)
@@ -140,7 +205,7 @@ def initialize_metrics():
     memory_usage_bytes.set(0)
     app_uptime_seconds.set(0)
     
-    print("📊 Custom metrics initialized with default values")
+    logger.debug("Custom metrics initialized with default values")
 
 # Initialize metrics when module is imported
 initialize_metrics()